@@ -0,0 +1 @@
+"""Benchmarks of the STL and OBJ readers, writers and diagnostics."""
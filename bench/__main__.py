@@ -0,0 +1,156 @@
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from geometry.normals import compute_normals
+
+from .cases import CASES, FORMAT_CASES, measure, prepare
+from .generators import GENERATORS
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+THRESHOLD = 0.2
+
+
+def run(generators, sizes, cases, repeat):
+    """Benchmark the cases on every mesh; yield one result dict per case.
+
+    Every case runs in a fresh process, so that its peak RSS is its own.
+    """
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(1, mp_context=context, max_tasks_per_child=1) as pool:
+        for generator in generators:
+            for size in sizes:
+                triangles = GENERATORS[generator](size)
+                normals = compute_normals(triangles)
+                with tempfile.TemporaryDirectory() as directory:
+                    prepare(directory, triangles, normals)
+                    for case in cases:
+                        seconds, nbytes, peak_rss = pool.submit(
+                            measure, case, directory, repeat
+                        ).result()
+                        yield {
+                            "generator": generator,
+                            "facets": len(triangles),
+                            "case": case,
+                            "seconds": seconds,
+                            "bytes": nbytes,
+                            "facets_per_s": len(triangles) / seconds,
+                            "mb_per_s": nbytes / seconds / 1e6,
+                            "peak_rss": peak_rss,
+                        }
+
+
+def compare(results, baseline, threshold):
+    """Yield `(result, ratio)` for the results slower than the baseline."""
+    times = {
+        (r["generator"], r["facets"], r["case"]): r["seconds"]
+        for r in baseline["results"]
+    }
+    for result in results:
+        before = times.get((result["generator"], result["facets"], result["case"]))
+        if before is not None and result["seconds"] > (1 + threshold) * before:
+            yield result, result["seconds"] / before
+
+
+def savings(results):
+    """Yield the size and time of the format cases relative to their default."""
+    default = {(r["generator"], r["facets"], r["case"]): r for r in results}
+    for result in results:
+        base = FORMAT_CASES.get(result["case"])
+        before = default.get((result["generator"], result["facets"], base))
+        if before is not None:
+            yield (
+                result,
+                before,
+                1 - result["bytes"] / before["bytes"],
+                1 - result["seconds"] / before["seconds"],
+            )
+
+
+def row(result):
+    rss = result["peak_rss"]
+    rss = f"{rss / 2**20:8.1f} MiB" if rss is not None else "       - MiB"
+    return (
+        f"{result['generator']:<10} {result['facets']:>9} {result['case']:<26} "
+        f"{1000 * result['seconds']:10.2f} ms {result['facets_per_s']:10.3g} facets/s "
+        f"{result['mb_per_s']:8.1f} MB/s {rss}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="python -m bench",
+        description="Benchmark the STL and OBJ readers, writers and diagnostics.",
+    )
+    parser.add_argument(
+        "--generator", choices=list(GENERATORS), action="append", help="(repeatable)"
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, metavar="N")
+    parser.add_argument(
+        "--case", choices=list(CASES), action="append", help="(repeatable)"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="best of N runs")
+    parser.add_argument("--output", help="JSON results file")
+    parser.add_argument("--compare", metavar="JSON", help="baseline results file")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=THRESHOLD,
+        help="relative slowdown reported as a regression",
+    )
+    args = parser.parse_args()
+
+    results = []
+    for result in run(
+        args.generator or list(GENERATORS),
+        args.sizes,
+        args.case or list(CASES),
+        args.repeat,
+    ):
+        print(row(result), flush=True)
+        results.append(result)
+
+    now = datetime.datetime.now()
+    output = args.output or os.path.join(
+        "output", "bench", f"bench-{now:%Y%m%d-%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "date": now.isoformat(timespec="seconds"),
+                "python": sys.version.split()[0],
+                "numpy": np.__version__,
+                "platform": platform.platform(),
+                "repeat": args.repeat,
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"results saved to {output}")
+
+    for result, before, size, seconds in savings(results):
+        print(
+            f"{result['generator']:<10} {result['facets']:>9} {result['case']:<26} "
+            f"{result['bytes'] / 1e6:8.1f} MB, saves {100 * size:5.1f}% size and "
+            f"{100 * seconds:5.1f}% time over {before['case']}"
+        )
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = list(compare(results, baseline, args.threshold))
+        for result, ratio in regressions:
+            print(f"regression: {row(result)} ({ratio:.2f}x slower)")
+        if regressions:
+            sys.exit(1)
+        print(f"no regression against {args.compare}")
@@ -0,0 +1,207 @@
+"""Benchmark cases: the geometry functions behind the notebook cells.
+
+A case loads its inputs from the files saved by `prepare` and returns a
+function that runs once and returns the number of bytes processed: the input
+file size for readers and converters, the output size for writers and the
+array sizes for the other functions.
+"""
+
+import io
+import os
+import sys
+import time
+
+import numpy as np
+
+from geometry import diagnostics, obj, stl
+from geometry.mesh import IndexedMesh
+from geometry.normals import compute_normals
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def prepare(directory, triangles, normals):
+    """Save a mesh as the input files of the cases."""
+    np.save(os.path.join(directory, "triangles.npy"), triangles)
+    np.save(os.path.join(directory, "normals.npy"), normals)
+    stl.write_ascii_stl(os.path.join(directory, "ascii.stl"), triangles, normals)
+    stl.write_binary_stl(os.path.join(directory, "binary.stl"), triangles, normals)
+    mesh = IndexedMesh.from_soup(triangles)
+    obj.write_obj(os.path.join(directory, "mesh.obj"), mesh.vertices, mesh.faces)
+
+
+def _arrays(directory):
+    triangles = np.load(os.path.join(directory, "triangles.npy"))
+    normals = np.load(os.path.join(directory, "normals.npy"))
+    return triangles, normals
+
+
+def _reader(read, name):
+    def case(directory):
+        path = os.path.join(directory, name)
+
+        def run():
+            read(path)
+            return os.path.getsize(path)
+
+        return run
+
+    return case
+
+
+def _converter(convert, name, output):
+    def case(directory):
+        path = os.path.join(directory, name)
+
+        def run():
+            convert(path, os.path.join(directory, output))
+            return os.path.getsize(path)
+
+        return run
+
+    return case
+
+
+def _writer(write, output, **options):
+    def case(directory):
+        triangles, normals = _arrays(directory)
+        path = os.path.join(directory, output)
+
+        def run():
+            write(path, triangles, normals, **options)
+            return os.path.getsize(path)
+
+        return run
+
+    return case
+
+
+def _check(function, normals=False):
+    def case(directory):
+        arrays = _arrays(directory) if normals else _arrays(directory)[:1]
+
+        def run():
+            function(*arrays)
+            return sum(array.nbytes for array in arrays)
+
+        return run
+
+    return case
+
+
+def read_ascii_stl_text(directory):
+    # The notebook cells parse STL text held in a string.
+    with open(os.path.join(directory, "ascii.stl"), encoding="utf-8") as f:
+        text = f.read()
+
+    def run():
+        data = text.encode()
+        stl.read_ascii_stl(io.BytesIO(data))
+        return len(data)
+
+    return run
+
+
+def make_stl(directory):
+    triangles, normals = _arrays(directory)
+    return lambda: len(stl.make_stl(triangles, normals))
+
+
+def _obj_writer(**options):
+    def case(directory):
+        mesh = IndexedMesh.from_soup(_arrays(directory)[0])
+        path = os.path.join(directory, "output.obj")
+
+        def run():
+            obj.write_obj(path, mesh.vertices, mesh.faces, **options)
+            return os.path.getsize(path)
+
+        return run
+
+    return case
+
+
+def _read_binary_stl(path):
+    return stl.read_binary_stl(path, mmap=False)
+
+
+def _read_ascii_stl_parallel(path):
+    return stl.read_ascii_stl(path, workers=os.cpu_count())
+
+
+CASES = {
+    "read_ascii_stl": _reader(stl.read_ascii_stl, "ascii.stl"),
+    "read_ascii_stl_parallel": _reader(_read_ascii_stl_parallel, "ascii.stl"),
+    "read_ascii_stl_text": read_ascii_stl_text,
+    "read_binary_stl": _reader(_read_binary_stl, "binary.stl"),
+    "read_obj": _reader(obj.read_obj, "mesh.obj"),
+    "make_stl": make_stl,
+    "write_ascii_stl": _writer(stl.write_ascii_stl, "output.stl"),
+    "write_binary_stl": _writer(stl.write_binary_stl, "output.stl"),
+    "write_obj": _obj_writer(),
+    "write_ascii_stl_shortest": _writer(
+        stl.write_ascii_stl, "output.stl", format="shortest"
+    ),
+    "write_ascii_stl_fixed": _writer(stl.write_ascii_stl, "output.stl", format="fixed"),
+    "write_ascii_stl_scientific": _writer(
+        stl.write_ascii_stl, "output.stl", format="scientific"
+    ),
+    "write_obj_repr": _obj_writer(format="repr"),
+    "write_obj_fixed": _obj_writer(format="fixed"),
+    "write_obj_scientific": _obj_writer(format="scientific"),
+    "binary_to_ascii_stl": _converter(
+        stl.binary_to_ascii_stl, "binary.stl", "output.stl"
+    ),
+    "ascii_to_binary_stl": _converter(
+        stl.ascii_to_binary_stl, "ascii.stl", "output.stl"
+    ),
+    "obj_to_stl": _converter(obj.obj_to_stl, "mesh.obj", "output.stl"),
+    "stl_to_obj": _converter(obj.stl_to_obj, "binary.stl", "output.obj"),
+    "compute_normals": _check(compute_normals),
+    "positive_octant": _check(diagnostics.positive_octant),
+    "orientation": _check(diagnostics.orientation, normals=True),
+    "shared_edge": _check(diagnostics.shared_edge),
+    "ascending": _check(diagnostics.ascending),
+    "diagnose": _check(diagnostics.diagnose, normals=True),
+}
+
+# Writers with another float format, and their case with the default one.
+FORMAT_CASES = {
+    f"{case}_{format}": case
+    for case, formats in [
+        ("write_ascii_stl", ["shortest", "fixed", "scientific"]),
+        ("write_obj", ["repr", "fixed", "scientific"]),
+    ]
+    for format in formats
+}
+
+
+def _peak_rss():
+    # On Linux, ru_maxrss includes the RSS of the parent that forked the
+    # worker: prefer the high-water mark of the worker memory map.
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return 1024 * int(line.split()[1])
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kibibytes elsewhere.
+    return peak if sys.platform == "darwin" else 1024 * peak
+
+
+def measure(name, directory, repeat):
+    """Run a case; return its best time, bytes processed and peak RSS."""
+    run = CASES[name](directory)
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = run()
+        seconds.append(time.perf_counter() - start)
+    return min(seconds), size, _peak_rss()
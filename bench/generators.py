@@ -0,0 +1,79 @@
+"""Synthetic meshes of (about) a given number of facets."""
+
+import math
+import os
+import tempfile
+
+import numpy as np
+from sdf import X, Y, Z, box, cylinder, sphere
+
+from geometry.csg import mesh_sdf_adaptive
+from geometry.mesh import IndexedMesh
+from geometry.stl import read_binary_stl
+
+CSG_AREA = 32.0
+
+
+def icosphere(facets):
+    """Unit sphere: subdivided icosahedron with the closest number of facets."""
+    t = (1 + math.sqrt(5)) / 2
+    vertices = np.array(
+        [
+            [-1, t, 0], [1, t, 0], [-1, -t, 0], [1, -t, 0],
+            [0, -1, t], [0, 1, t], [0, -1, -t], [0, 1, -t],
+            [t, 0, -1], [t, 0, 1], [-t, 0, -1], [-t, 0, 1],
+        ],
+        dtype=np.float64,
+    )  # fmt: skip
+    faces = np.array(
+        [
+            [0, 11, 5], [0, 5, 1], [0, 1, 7], [0, 7, 10], [0, 10, 11],
+            [1, 5, 9], [5, 11, 4], [11, 10, 2], [10, 7, 6], [7, 1, 8],
+            [3, 9, 4], [3, 4, 2], [3, 2, 6], [3, 6, 8], [3, 8, 9],
+            [4, 9, 5], [2, 4, 11], [6, 2, 10], [8, 6, 7], [9, 8, 1],
+        ]
+    )  # fmt: skip
+    levels = max(0, round(math.log(max(facets, 20) / 20, 4)))
+    for _ in range(levels):
+        # One vertex per edge, at its midpoint; each face is split in four.
+        edges = np.sort(np.stack([faces, np.roll(faces, -1, axis=1)], axis=2), axis=2)
+        keys, inverse = np.unique(
+            edges[..., 0] * len(vertices) + edges[..., 1], return_inverse=True
+        )
+        a, b = np.divmod(keys, len(vertices))
+        middles = len(vertices) + inverse.reshape(-1, 3)
+        vertices = np.concatenate([vertices, (vertices[a] + vertices[b]) / 2])
+        (i, j, k), (ij, jk, ki) = faces.T, middles.T
+        faces = np.concatenate(
+            [
+                np.stack([i, ij, ki], axis=1),
+                np.stack([ij, j, jk], axis=1),
+                np.stack([ki, jk, k], axis=1),
+                np.stack([ij, jk, ki], axis=1),
+            ]
+        )
+    vertices /= np.linalg.norm(vertices, axis=1, keepdims=True)
+    return IndexedMesh(vertices, faces).to_soup()
+
+
+def soup(facets, seed=0):
+    """Random triangles in the unit cube."""
+    rng = np.random.default_rng(seed)
+    return rng.random((facets, 3, 3), dtype=np.float32)
+
+
+def csg(facets):
+    """The CSG demo of the notebook, meshed with about that many facets."""
+    shape = sphere(1) & box(1.5)
+    c = cylinder(0.5)
+    shape = shape - (c.orient(X) | c.orient(Y) | c.orient(Z))
+    # The demo has about 32 / step ** 2 facets.
+    step = math.sqrt(CSG_AREA / facets)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "csg.stl")
+        mesh_sdf_adaptive(shape, path, step=step, verbose=False)
+        triangles, _, _ = read_binary_stl(path, mmap=False)
+    return np.ascontiguousarray(triangles)
+
+
+GENERATORS = {"icosphere": icosphere, "soup": soup, "csg": csg}
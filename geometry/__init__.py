@@ -0,0 +1 @@
+"""Fast readers, writers and tools for 3D geometry file formats."""
@@ -0,0 +1,375 @@
+"""Bounding volume hierarchy of triangles, for ray and point queries.
+
+The tree is built one level at a time: the triangles of every node of a level
+are binned along the longest axis of their centroids and each node is split
+between two bins with the smallest surface area heuristic (SAH) cost. Queries
+traverse the tree for whole batches of rays or points at once, as arrays of
+(query, node) pairs.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import numpy as np
+from sdf.d3 import SDF3
+
+from .normals import compute_normals
+
+BINS = 16
+LEAF_SIZE = 4
+
+# Queries per task.
+CHUNK_SIZE = 1 << 16
+# (query, node) pairs per traversal step.
+PAIRS = 1 << 16
+
+# A direction unlikely to be aligned with the edges of a mesh.
+DIRECTION = np.array([1.0, np.sqrt(2.0), np.pi]) / np.sqrt(3.0 + np.pi**2)
+
+
+def _dot(a, b):
+    return np.einsum("ij,ij->i", a, b)
+
+
+def _area(lo, hi):
+    """Surface area of boxes; 0 for empty ones."""
+    size = np.maximum(hi - lo, 0.0)
+    x, y, z = np.moveaxis(size, -1, 0)
+    return 2 * (x * y + y * z + z * x)
+
+
+def _box_distance2(lo, hi, points):
+    """Squared distance between points and boxes."""
+    gap = np.maximum(np.maximum(lo - points, points - hi), 0.0)
+    return _dot(gap, gap)
+
+
+def _slabs(lo, hi, origins, inverses):
+    """Parameters of the entry in and exit from boxes along rays."""
+    with np.errstate(invalid="ignore"):
+        t0 = (lo - origins) * inverses
+        t1 = (hi - origins) * inverses
+    # fmin and fmax ignore the NaNs of rays within a slab plane.
+    near = np.fmax.reduce(np.fmin(t0, t1), axis=1)
+    far = np.fmin.reduce(np.fmax(t0, t1), axis=1)
+    return near, far
+
+
+def _ray_triangles(origins, directions, triangles):
+    """Parameters of the ray-triangle intersections (Möller-Trumbore), inf if none."""
+    a, b, c = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+    e1, e2 = b - a, c - a
+    p = np.cross(directions, e2)
+    det = _dot(e1, p)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        inverse = 1.0 / det
+        s = origins - a
+        u = _dot(s, p) * inverse
+        q = np.cross(s, e1)
+        v = _dot(directions, q) * inverse
+        t = _dot(e2, q) * inverse
+        hit = (det != 0) & (u >= 0) & (v >= 0) & (u + v <= 1) & (t >= 0)
+    return np.where(hit, t, np.inf)
+
+
+def _closest_points(points, triangles):
+    """Closest points of triangles, by Voronoi region (Ericson, RTCD 5.1.5)."""
+    a, b, c = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+    ab, ac, bc = b - a, c - a, c - b
+    ap, bp, cp = points - a, points - b, points - c
+    d1, d2 = _dot(ab, ap), _dot(ac, ap)
+    d3, d4 = _dot(ab, bp), _dot(ac, bp)
+    d5, d6 = _dot(ab, cp), _dot(ac, cp)
+    va, vb, vc = d3 * d6 - d5 * d4, d5 * d2 - d1 * d6, d1 * d4 - d3 * d2
+
+    def where(mask, x, y):
+        return np.where(mask[:, None], x, y)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # From the lowest to the highest priority region.
+        denominator = va + vb + vc
+        result = a + ab * (vb / denominator)[:, None] + ac * (vc / denominator)[:, None]
+        w = (d4 - d3) / ((d4 - d3) + (d5 - d6))
+        result = where((va <= 0) & (d4 >= d3) & (d5 >= d6), b + bc * w[:, None], result)
+        w = d2 / (d2 - d6)
+        result = where((vb <= 0) & (d2 >= 0) & (d6 <= 0), a + ac * w[:, None], result)
+        result = where((d6 >= 0) & (d5 <= d6), c, result)
+        v = d1 / (d1 - d3)
+        result = where((vc <= 0) & (d1 >= 0) & (d3 <= 0), a + ab * v[:, None], result)
+        result = where((d3 >= 0) & (d4 <= d3), b, result)
+        result = where((d1 <= 0) & (d2 <= 0), a, result)
+    # Degenerate triangles.
+    return where(np.isnan(result).any(axis=1), a, result)
+
+
+def _ranges(starts, counts):
+    """Concatenate the index ranges `start, ..., start + count - 1`."""
+    offsets = np.cumsum(counts) - counts
+    return np.repeat(starts - offsets, counts) + np.arange(counts.sum())
+
+
+class BVH:
+    """Bounding volume hierarchy of `(n, 3, 3)` triangles.
+
+    Node `i` has the bounds `lo[i]`, `hi[i]` and is either internal, with the
+    children `child[i]` and `child[i] + 1`, or a leaf (`child[i] == -1`) with
+    the triangles `start[i]` to `start[i] + count[i] - 1` of `triangles`.
+    These are the input triangles in tree order: `index` maps them back to
+    the input facets.
+    """
+
+    def __init__(self, triangles, leaf_size=LEAF_SIZE, bins=BINS):
+        triangles = np.asarray(triangles, dtype=np.float64).reshape(-1, 3, 3)
+        if len(triangles) == 0:
+            raise ValueError("no triangles")
+        self.leaf_size = leaf_size
+        self.bins = bins
+        bounds = triangles.min(axis=1), triangles.max(axis=1), triangles.mean(axis=1)
+        order = np.arange(len(triangles))
+        levels = []
+        starts, counts = np.zeros(1, dtype=np.int64), np.full(1, len(triangles))
+        first = 0  # Index of the first node of the level.
+        while len(starts):
+            level, split, left = self._split(bounds, order, starts, counts)
+            child = np.full(len(starts), -1, dtype=np.int64)
+            first += len(starts)
+            child[split] = first + 2 * np.arange(np.count_nonzero(split))
+            levels.append((*level, child, starts, counts))
+            starts, counts = (
+                np.stack([starts[split], starts[split] + left], axis=1).reshape(-1),
+                np.stack([left, counts[split] - left], axis=1).reshape(-1),
+            )
+        self.lo, self.hi, self.child, self.start, self.count = (
+            np.concatenate(arrays) for arrays in zip(*levels)
+        )
+        self.depth = len(levels)
+        self.index = order
+        self.triangles = triangles[order]
+        normals = compute_normals(self.triangles)
+        offsets = _dot(normals, self.triangles[:, 0])
+        self.planes = np.column_stack([normals, offsets])
+
+    def _split(self, bounds, order, starts, counts):
+        """Bound and split the nodes of a level; reorder their triangles.
+
+        Return the node bounds, the nodes to split and the size of their left
+        child.
+        """
+        members = _ranges(starts, counts)
+        lo, hi, centroids = (array[order[members]] for array in bounds)
+        offsets = np.cumsum(counts) - counts
+        node_lo = np.minimum.reduceat(lo, offsets)
+        node_hi = np.maximum.reduceat(hi, offsets)
+        split = counts > self.leaf_size
+        if not split.any():
+            return (node_lo, node_hi), split, counts[split]
+
+        # Bin the centroids along their longest axis.
+        c_lo = np.minimum.reduceat(centroids, offsets)
+        c_hi = np.maximum.reduceat(centroids, offsets)
+        axis = np.argmax(c_hi - c_lo, axis=1)
+        rows = np.arange(len(starts))
+        extent = (c_hi - c_lo)[rows, axis]
+        scale = np.divide(
+            self.bins, extent, out=np.zeros_like(extent), where=extent > 0
+        )
+        nodes = np.repeat(rows, counts)
+        x = centroids[np.arange(len(members)), axis[nodes]] - c_lo[rows, axis][nodes]
+        bins = np.clip((x * scale[nodes]).astype(np.int64), 0, self.bins - 1)
+        keys = nodes * self.bins + bins
+        sort = np.argsort(keys, kind="stable")
+        order[members] = order[members][sort]
+        keys, lo, hi = keys[sort], lo[sort], hi[sort]
+
+        # Bounds and sizes of the bins, then of both sides of every split.
+        first = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        shape = (len(starts), self.bins)
+        bin_lo = np.full((*shape, 3), np.inf)
+        bin_hi = np.full((*shape, 3), -np.inf)
+        bin_count = np.zeros(shape, dtype=np.int64)
+        used = np.unravel_index(keys[first], shape)
+        bin_lo[used] = np.minimum.reduceat(lo, first)
+        bin_hi[used] = np.maximum.reduceat(hi, first)
+        bin_count[used] = np.diff(np.r_[first, len(keys)])
+        left_lo = np.minimum.accumulate(bin_lo, axis=1)[:, :-1]
+        left_hi = np.maximum.accumulate(bin_hi, axis=1)[:, :-1]
+        left_count = np.cumsum(bin_count, axis=1)[:, :-1]
+        right_lo = np.minimum.accumulate(bin_lo[:, ::-1], axis=1)[:, -2::-1]
+        right_hi = np.maximum.accumulate(bin_hi[:, ::-1], axis=1)[:, -2::-1]
+        right_count = counts[:, None] - left_count
+        cost = (
+            _area(left_lo, left_hi) * left_count
+            + _area(right_lo, right_hi) * right_count
+        )
+        cost[(left_count == 0) | (right_count == 0)] = np.inf
+        best = np.argmin(cost, axis=1)
+        left = left_count[rows, best]
+        # When all the centroids fall in a single bin, split in the middle.
+        single = np.isinf(cost[rows, best])
+        left[single] = counts[single] // 2
+        return (node_lo, node_hi), split, left[split]
+
+    def __len__(self):
+        return len(self.triangles)
+
+    @property
+    def nbytes(self):
+        arrays = (self.lo, self.hi, self.child, self.start, self.count)
+        arrays += (self.index, self.triangles, self.planes)
+        return sum(array.nbytes for array in arrays)
+
+    def __repr__(self):
+        return (
+            f"BVH({len(self)} triangles, {len(self.child)} nodes, depth {self.depth})"
+        )
+
+    def _traverse(self, queries, keep, visit):
+        """Visit the triangles of the leaves reached by queries.
+
+        The (query, node) pairs that `keep` accepts are expanded depth first,
+        by blocks of at most `PAIRS`: memory stays bounded and the first
+        leaves visited prune the next pairs. `visit` is called with arrays
+        of queries and triangles.
+        """
+        stack = [(queries, np.zeros(len(queries), dtype=np.int64))]
+        while stack:
+            queries, nodes = stack.pop()
+            if len(queries) > PAIRS:
+                stack.append((queries[PAIRS:], nodes[PAIRS:]))
+                queries, nodes = queries[:PAIRS], nodes[:PAIRS]
+            accepted = keep(queries, nodes)
+            queries, nodes = queries[accepted], nodes[accepted]
+            leaf = self.child[nodes] < 0
+            counts = self.count[nodes[leaf]]
+            if len(counts):
+                triangles = _ranges(self.start[nodes[leaf]], counts)
+                visit(np.repeat(queries[leaf], counts), triangles)
+            children = self.child[nodes[~leaf]][:, None] + np.array([0, 1])
+            if len(children):
+                stack.append((np.repeat(queries[~leaf], 2), children.reshape(-1)))
+
+    def _batch(self, function, arrays, workers):
+        """Apply `function` to chunks of the query arrays, with `workers` threads."""
+        n = len(arrays[0])
+        chunks = [
+            [array[i : i + CHUNK_SIZE] for array in arrays]
+            for i in range(0, n, CHUNK_SIZE)
+        ]
+        if workers <= 1 or len(chunks) <= 1:
+            results = [function(*chunk) for chunk in chunks]
+        else:
+            with ThreadPoolExecutor(workers) as executor:
+                results = list(executor.map(lambda chunk: function(*chunk), chunks))
+        if not results:
+            results = [function(*(array[:0] for array in arrays))]
+        return tuple(np.concatenate(result) for result in zip(*results))
+
+    def _intersect(self, origins, directions, count=False):
+        n = len(origins)
+        with np.errstate(divide="ignore"):
+            inverses = 1.0 / directions
+        t = np.full(n, np.inf)
+        facets = np.full(n, -1, dtype=np.int64)
+        hits = np.zeros(n, dtype=np.int64)
+
+        def keep(queries, nodes):
+            near, far = _slabs(
+                self.lo[nodes], self.hi[nodes], origins[queries], inverses[queries]
+            )
+            if count:
+                return (near <= far) & (far >= 0)
+            return (near <= far) & (far >= 0) & (near <= t[queries])
+
+        def visit(q, f):
+            s = _ray_triangles(origins[q], directions[q], self.triangles[f])
+            if count:
+                hits[:] += np.bincount(q[(s > 0) & np.isfinite(s)], minlength=n)
+            else:
+                np.minimum.at(t, q, s)
+                best = np.isfinite(s) & (s == t[q])
+                facets[q[best]] = f[best]
+
+        self._traverse(np.arange(n), keep, visit)
+        if count:
+            return (hits,)
+        return t, np.where(facets >= 0, self.index[facets], -1)
+
+    def intersect(self, origins, directions, workers=1):
+        """Cast rays; return the parameters `t` and facets of the first hits.
+
+        The hit points are `origins + t * directions`; `t` is inf and the
+        facet -1 for the rays that miss the mesh.
+        """
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+        directions = np.broadcast_to(
+            np.asarray(directions, dtype=np.float64), origins.shape
+        )
+        return self._batch(self._intersect, (origins, directions), workers)
+
+    def _closest(self, points):
+        n = len(points)
+        distances = np.full(n, np.inf)
+        closest = np.zeros((n, 3))
+        facets = np.zeros(n, dtype=np.int64)
+
+        def keep(queries, nodes):
+            d = _box_distance2(self.lo[nodes], self.hi[nodes], points[queries])
+            return d < distances[queries]
+
+        def visit(q, f):
+            # The distance to the plane of a triangle is a cheap lower bound.
+            planes = self.planes[f]
+            d = _dot(points[q], planes[:, :3]) - planes[:, 3]
+            near = d * d < distances[q]
+            q, f = q[near], f[near]
+            c = _closest_points(points[q], self.triangles[f])
+            d = _dot(points[q] - c, points[q] - c)
+            np.minimum.at(distances, q, d)
+            best = d == distances[q]
+            closest[q[best]], facets[q[best]] = c[best], f[best]
+
+        # Descend to the nearest leaf, for a first upper bound.
+        nodes = np.zeros(n, dtype=np.int64)
+        internal = np.arange(n)
+        while len(internal := internal[self.child[nodes[internal]] >= 0]):
+            children = self.child[nodes[internal]]
+            p = points[internal]
+            d0 = _box_distance2(self.lo[children], self.hi[children], p)
+            d1 = _box_distance2(self.lo[children + 1], self.hi[children + 1], p)
+            # Points are often inside of both boxes: pick the closest center.
+            c0 = _dot(*[p - (self.lo[children] + self.hi[children]) / 2] * 2)
+            c1 = _dot(*[p - (self.lo[children + 1] + self.hi[children + 1]) / 2] * 2)
+            second = np.where(d0 == d1, c1 < c0, d1 < d0)
+            nodes[internal] = children + second
+        counts = self.count[nodes]
+        visit(np.repeat(np.arange(n), counts), _ranges(self.start[nodes], counts))
+        self._traverse(np.arange(n), keep, visit)
+        return closest, np.sqrt(distances), self.index[facets]
+
+    def closest(self, points, workers=1):
+        """Return the closest mesh points, their distances and facets."""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        return self._batch(self._closest, (points,), workers)
+
+    def contains(self, points, workers=1):
+        """Test if points are inside of the mesh, which must be closed.
+
+        A point is inside when a ray from it crosses the mesh an odd number of
+        times.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        directions = np.broadcast_to(DIRECTION, points.shape)
+        count = partial(self._intersect, count=True)
+        (hits,) = self._batch(count, (points, directions), workers)
+        return hits % 2 == 1
+
+    def signed_distance(self, points, workers=1):
+        """Distance to the mesh, negative inside of it."""
+        _, distances, _ = self.closest(points, workers)
+        return np.where(self.contains(points, workers), -distances, distances)
+
+    def sdf(self, workers=1):
+        """Return the signed distance to the mesh as a sdf shape."""
+        return SDF3(
+            lambda points: self.signed_distance(points, workers).reshape((-1, 1))
+        )
@@ -0,0 +1,162 @@
+"""Cache of parsed meshes, in memory and on disk.
+
+Meshes are keyed on the file path, modification time and size (and
+optionally on a hash of the file contents). The most recently used meshes
+are kept in memory within a byte budget; every parsed mesh is also saved as
+raw `.npy` files, which are memory-mapped when the file is loaded again.
+Entries of rewritten files are never read again: the least recently used
+entries are removed from the directory beyond another byte budget.
+"""
+
+import collections
+import hashlib
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from .lod import decimate
+from .mesh import IndexedMesh
+from .obj import read_obj, triangulate
+from .stl import read_stl
+
+CACHE_DIR = os.path.join(".cache", "meshes")
+MAX_BYTES = 1 << 30
+MAX_DISK_BYTES = 4 << 30
+
+
+def _parse(path):
+    if os.path.splitext(path)[1].lower() == ".obj":
+        obj = read_obj(path)
+        return IndexedMesh(obj.vertices, triangulate(obj.face_vertices, obj.face_sizes))
+    triangles, _ = read_stl(path)
+    return IndexedMesh.from_soup(triangles)
+
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 24):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MeshCache:
+    """LRU cache of meshes loaded from files, backed by a cache directory."""
+
+    def __init__(
+        self,
+        directory=CACHE_DIR,
+        max_bytes=MAX_BYTES,
+        content_hash=False,
+        max_disk_bytes=MAX_DISK_BYTES,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.content_hash = content_hash
+        self.nbytes = 0
+        self._meshes = collections.OrderedDict()
+
+    def key(self, path, *variant):
+        """Return the cache key of a file (and of a variant of its mesh)."""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        parts = [path, str(stat.st_mtime_ns), str(stat.st_size)]
+        if self.content_hash:
+            parts.append(_file_hash(path))
+        parts.extend(map(repr, variant))
+        return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+    def get(self, key, build):
+        """Return the mesh cached under `key`, calling `build()` on a miss."""
+        mesh = self._meshes.get(key)
+        if mesh is not None:
+            self._meshes.move_to_end(key)
+            return mesh
+        mesh = self._read(key)
+        if mesh is None:
+            mesh = build()
+            self._write(key, mesh)
+        self._remember(key, mesh)
+        return mesh
+
+    def load(self, path, max_faces=None, quadric=False):
+        """Return the mesh of an STL or OBJ file as an `IndexedMesh`.
+
+        With `max_faces`, the mesh is decimated to at most that many faces;
+        each level of detail is cached like the full mesh.
+        """
+        mesh = self.get(self.key(path), lambda: _parse(path))
+        if max_faces is None or len(mesh.faces) <= max_faces:
+            return mesh
+        key = self.key(path, "lod", max_faces, quadric)
+        return self.get(key, lambda: decimate(mesh, max_faces, quadric))
+
+    def clear(self, disk=False):
+        self._meshes.clear()
+        self.nbytes = 0
+        if disk:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _remember(self, key, mesh):
+        self._meshes[key] = mesh
+        self.nbytes += mesh.nbytes
+        while self.nbytes > self.max_bytes and len(self._meshes) > 1:
+            _, evicted = self._meshes.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+
+    def _read(self, key):
+        entry = os.path.join(self.directory, key)
+        try:
+            vertices = np.load(os.path.join(entry, "vertices.npy"), mmap_mode="r")
+            faces = np.load(os.path.join(entry, "faces.npy"), mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        try:
+            # The modification time of an entry is its last use.
+            os.utime(entry)
+        except OSError:
+            pass
+        return IndexedMesh(vertices, faces)
+
+    def _write(self, key, mesh):
+        # Written aside, then renamed: readers never see a partial entry.
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = tempfile.mkdtemp(prefix=".", dir=self.directory)
+        np.save(os.path.join(temporary, "vertices.npy"), mesh.vertices)
+        np.save(os.path.join(temporary, "faces.npy"), mesh.faces)
+        try:
+            os.replace(temporary, os.path.join(self.directory, key))
+        except OSError:
+            # Another process stored the same entry first.
+            shutil.rmtree(temporary, ignore_errors=True)
+        self._evict(key)
+
+    def _evict(self, keep):
+        # Remove the least recently used entries (but `keep`) over the budget.
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith("."):
+                continue  # Being written.
+            try:
+                size = sum(f.stat().st_size for f in os.scandir(entry.path))
+                entries.append((entry.stat().st_mtime_ns, size, entry.name))
+            except OSError:
+                continue  # Removed by another process.
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            if name != keep:
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+                total -= size
+
+
+cache = MeshCache()
+
+
+def load_mesh(path, max_faces=None, quadric=False):
+    """Load an STL or OBJ file through the default cache."""
+    return cache.load(path, max_faces, quadric)
@@ -0,0 +1,266 @@
+"""Meshing of signed distance functions, streamed to binary STL files."""
+
+import contextlib
+import itertools
+import os
+import time
+import tracemalloc
+from functools import partial
+from multiprocessing.pool import ThreadPool
+from typing import NamedTuple
+
+import numpy as np
+from sdf import progress
+from sdf.mesh import _cartesian_product, _estimate_bounds, _marching_cubes, _worker
+
+from .stl import StlWriter
+
+WORKERS = os.cpu_count()
+SAMPLES = 2**22
+BATCH_SIZE = 32
+LEAF_SIZE = 8
+LEAVES = 64
+
+
+class MeshStats(NamedTuple):
+    facets: int
+    samples: int
+    batches: int
+    skipped: int
+    empty: int
+    failed: int
+    seconds: float
+    peak_memory: int
+
+    def __str__(self):
+        text = (
+            f"{self.facets} facets from {self.samples} samples "
+            f"in {self.batches} batches ({self.skipped} skipped, "
+            f"{self.empty} empty, {self.failed} failed): {self.seconds:.2f} s"
+        )
+        if self.peak_memory is not None:
+            text += f", peak memory {self.peak_memory / 2**20:.1f} MiB"
+        return text
+
+
+@contextlib.contextmanager
+def _tracing(enabled=True):
+    """Trace the memory allocations; yield a function returning the peak.
+
+    Tracing slows every allocation down: when not `enabled`, the peak is None.
+    """
+    if not enabled:
+        yield lambda: None
+        return
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+    else:
+        tracemalloc.start()
+    try:
+        yield lambda: tracemalloc.get_traced_memory()[1]
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+
+
+def _reset_stats(shape):
+    # Counters of `geometry.expression` nodes, which are shared by all the
+    # identical expressions: count this run only.
+    stats = getattr(shape, "stats", None)
+    if stats is not None:
+        stats.reset()
+
+
+def _steps(bounds, step, samples):
+    (x0, y0, z0), (x1, y1, z1) = bounds
+    if step is None:
+        volume = (x1 - x0) * (y1 - y0) * (z1 - z0)
+        step = (volume / samples) ** (1 / 3)
+    return np.broadcast_to(np.asarray(step, dtype=np.float64), (3,))
+
+
+def _batches(bounds, steps, batch_size):
+    axes = []
+    for start, stop, step in zip(*bounds, steps):
+        values = np.arange(start, stop, step)
+        # Consecutive batches share a sample plane, so their meshes join.
+        axes.append(
+            [values[i : i + batch_size + 1] for i in range(0, len(values), batch_size)]
+        )
+    return list(itertools.product(*axes))
+
+
+def mesh_sdf(
+    shape,
+    path,
+    step=None,
+    bounds=None,
+    samples=SAMPLES,
+    workers=WORKERS,
+    batch_size=BATCH_SIZE,
+    sparse=True,
+    verbose=True,
+):
+    """Mesh a `sdf` shape into a binary STL path; return the `MeshStats`.
+
+    The grid is split into batches of `batch_size` samples per axis, meshed
+    by `workers` threads and written as soon as they are done; when `step`
+    is None, it is chosen to sample the bounds with about `samples` points.
+    The `stats` of a `geometry.expression` shape are reset first; the peak
+    memory is only traced with `verbose` (None otherwise).
+    """
+    start = time.perf_counter()
+    _reset_stats(shape)
+    with _tracing(verbose) as peak_memory:
+        if bounds is None:
+            bounds = _estimate_bounds(shape)
+        steps = _steps(bounds, step, samples)
+        batches = _batches(bounds, steps, batch_size)
+        sizes = [len(x) * len(y) * len(z) for x, y, z in batches]
+        skipped = empty = 0
+        bar = progress.Bar(len(batches), enabled=verbose)
+        worker = partial(_worker, shape, sparse=sparse)
+        with ThreadPool(workers) as pool, StlWriter(path) as writer:
+            for points in pool.imap(worker, batches):
+                bar.increment(1)
+                if points is None:
+                    skipped += 1
+                elif len(points) == 0:
+                    empty += 1
+                else:
+                    writer.write(points)
+        bar.done()
+        stats = MeshStats(
+            writer.count,
+            sum(sizes),
+            len(batches),
+            skipped,
+            empty,
+            0,
+            time.perf_counter() - start,
+            peak_memory(),
+        )
+    if verbose:
+        print(stats)
+    return stats
+
+
+def _narrow_band(shape, axes, leaf_size):
+    """Find the leaf blocks of grid cells that may intersect the surface.
+
+    Return their lower and upper cell indices, the number of evaluations and
+    the number of pruned blocks.
+    """
+    cells = np.array([len(values) - 1 for values in axes])
+    size = leaf_size
+    while size < cells.max():
+        size *= 2
+    lo = np.zeros((1, 3), dtype=np.int64)
+    evaluations = pruned = 0
+    while True:
+        hi = np.minimum(lo + size, cells)
+        start = np.stack([v[i] for v, i in zip(axes, lo.T)], axis=1)
+        stop = np.stack([v[i] for v, i in zip(axes, hi.T)], axis=1)
+        values = shape((start + stop) / 2).reshape(-1)
+        radius = 0.5 * np.linalg.norm(stop - start, axis=1)
+        # The shape values never exceed the distance to the surface.
+        near = np.abs(values) <= radius
+        evaluations += len(lo)
+        pruned += len(lo) - np.count_nonzero(near)
+        lo, hi = lo[near], hi[near]
+        if size == leaf_size:
+            return lo, hi, evaluations, pruned
+        size //= 2
+        offsets = np.array(list(itertools.product((0, size), repeat=3)))
+        lo = (lo[:, None, :] + offsets).reshape(-1, 3)
+        lo = lo[np.all(lo < cells, axis=1)]
+
+
+def _leaf_worker(shape, axes, blocks):
+    lo, hi = blocks
+    grids = [
+        [values[i : j + 1] for values, i, j in zip(axes, start, stop)]
+        for start, stop in zip(lo, hi)
+    ]
+    points = np.concatenate([_cartesian_product(*grid) for grid in grids])
+    values = shape(points).reshape(-1)
+    triangles = []
+    offset = failed = 0
+    for X, Y, Z in grids:
+        size = len(X) * len(Y) * len(Z)
+        volume = values[offset : offset + size].reshape((len(X), len(Y), len(Z)))
+        offset += size
+        if volume.min() > 0 or volume.max() < 0:
+            continue
+        try:
+            triangles.append(
+                _marching_cubes(volume) * (X[1] - X[0], Y[1] - Y[0], Z[1] - Z[0])
+                + (X[0], Y[0], Z[0])
+            )
+        except (RuntimeError, ValueError):
+            failed += 1
+    if triangles:
+        return np.concatenate(triangles), len(triangles), failed, len(points)
+    return None, 0, failed, len(points)
+
+
+def mesh_sdf_adaptive(
+    shape,
+    path,
+    step=None,
+    bounds=None,
+    samples=SAMPLES,
+    workers=WORKERS,
+    leaf_size=LEAF_SIZE,
+    verbose=True,
+):
+    """Mesh a `sdf` shape into a binary STL path, sampling only near the surface.
+
+    The sampling grid is the one of `mesh_sdf`, but its blocks are subdivided
+    (octree-style) only when the shape value at their center is smaller than
+    their half-diagonal; marching cubes then runs on the remaining blocks of
+    `leaf_size` cells. This is exact as long as the shape never overestimates
+    the distance to its surface, which holds for the sdf primitives and
+    boolean operations. Return the `MeshStats`, where batches are groups of
+    leaves, skipped counts the pruned blocks, empty the leaves without
+    surface and failed the leaves where marching cubes failed (left as holes).
+    The `stats` of a `geometry.expression` shape are reset first; the peak
+    memory is only traced with `verbose` (None otherwise).
+    """
+    start = time.perf_counter()
+    _reset_stats(shape)
+    with _tracing(verbose) as peak_memory:
+        if bounds is None:
+            bounds = _estimate_bounds(shape)
+        steps = _steps(bounds, step, samples)
+        axes = [np.arange(*args) for args in zip(*bounds, steps)]
+        lo, hi, evaluations, pruned = _narrow_band(shape, axes, leaf_size)
+        groups = [
+            (lo[i : i + LEAVES], hi[i : i + LEAVES]) for i in range(0, len(lo), LEAVES)
+        ]
+        meshed = failed = 0
+        bar = progress.Bar(len(groups), enabled=verbose)
+        worker = partial(_leaf_worker, shape, axes)
+        with ThreadPool(workers) as pool, StlWriter(path) as writer:
+            for points, leaves, errors, size in pool.imap(worker, groups):
+                bar.increment(1)
+                meshed += leaves
+                failed += errors
+                evaluations += size
+                if points is not None:
+                    writer.write(points)
+        bar.done()
+        stats = MeshStats(
+            writer.count,
+            evaluations,
+            len(groups),
+            pruned,
+            len(lo) - meshed - failed,
+            failed,
+            time.perf_counter() - start,
+            peak_memory(),
+        )
+    if verbose:
+        print(stats)
+    return stats
@@ -0,0 +1,57 @@
+"""Culling of the faces that cannot be seen from a camera."""
+
+from typing import NamedTuple
+
+import numpy as np
+
+
+class CullStats(NamedTuple):
+    faces: int
+    outside: int
+    backfacing: int
+    small: int
+
+    @property
+    def kept(self):
+        return self.faces - self.outside - self.backfacing - self.small
+
+    def __str__(self):
+        return (
+            f"{self.kept} of {self.faces} faces kept "
+            f"({self.outside} outside the view, {self.backfacing} back-facing, "
+            f"{self.small} below the minimal area)"
+        )
+
+
+def cull(vertices, faces, transform, min_area=0.0, backfaces=True):
+    """Select the faces of a mesh that are visible through `transform`.
+
+    `transform` is the 4x4 model-view-projection matrix. Faces are culled when
+    they lie outside of the [-1, 1] x [-1, 1] view, face away from the camera
+    (they are clockwise once projected) or cover less than `min_area` in
+    normalized device coordinates. Returns the kept faces and a `CullStats`.
+    """
+    vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+    faces = np.asarray(faces).reshape(-1, 3)
+    points = vertices @ transform[:3, :3].T + transform[:3, 3]
+    w = vertices @ transform[3, :3] + transform[3, 3]
+    screen = points[:, :2] / w[:, np.newaxis]
+    triangles = screen[faces]
+
+    outside = np.any(
+        np.all(triangles < -1, axis=1) | np.all(triangles > 1, axis=1), axis=1
+    )
+    # Twice the signed area: the z component of the face normal in screen space.
+    u = triangles[:, 1] - triangles[:, 0]
+    v = triangles[:, 2] - triangles[:, 0]
+    areas = (u[:, 0] * v[:, 1] - u[:, 1] * v[:, 0]) / 2
+    backfacing = ~outside & (areas <= 0) if backfaces else np.zeros_like(outside)
+    small = ~outside & ~backfacing & (np.abs(areas) < min_area)
+
+    stats = CullStats(
+        len(faces),
+        int(np.count_nonzero(outside)),
+        int(np.count_nonzero(backfacing)),
+        int(np.count_nonzero(small)),
+    )
+    return faces[~(outside | backfacing | small)], stats
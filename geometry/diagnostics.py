@@ -0,0 +1,353 @@
+"""STL rules & diagnostics.
+
+  - **Positive octant rule.** All vertex coordinates are non-negative.
+
+  - **Orientation rule.** All normals are (approximately) unit vectors and
+    follow the right-hand rule.
+
+  - **Shared edge rule.** Each triangle edge appears exactly twice.
+
+  - **Ascending rule.** The z-coordinates of the triangle barycenters are a
+    non-decreasing sequence.
+
+Every rule reports the percentage of facets that break it, and their indices.
+A `DiagnosticSession` keeps these results up to date while facets are added,
+removed or modified, at a cost proportional to the number of changed facets.
+"""
+
+from typing import NamedTuple
+
+import numpy as np
+
+from .mesh import IndexedMesh
+from .normals import compute_normals
+
+# Accepted deviation of |normal| from 1 and of cos(normal, right-hand normal)
+# from 1 (about 2.5 degrees).
+TOLERANCE = 1e-3
+
+
+class RuleReport(NamedTuple):
+    rule: str
+    percentage: float
+    indices: np.ndarray
+
+    def __str__(self):
+        status = "ok" if len(self.indices) == 0 else f"{len(self.indices)} facets"
+        return f"{self.rule}: {self.percentage:.2f} % violations ({status})"
+
+
+class Report(NamedTuple):
+    positive_octant: RuleReport
+    orientation: RuleReport
+    shared_edge: RuleReport
+    ascending: RuleReport
+
+    def __str__(self):
+        return "\n".join(str(rule) for rule in self if rule is not None)
+
+
+def _report(rule, mask):
+    percentage = 100.0 * np.count_nonzero(mask) / len(mask) if len(mask) else 0.0
+    return RuleReport(rule, percentage, np.flatnonzero(mask))
+
+
+def _positive_octant(triangles):
+    return np.any(triangles < 0, axis=(1, 2))
+
+
+def _orientation(triangles, normals, tolerance):
+    normals = np.asarray(normals, dtype=np.float32)
+    right = compute_normals(triangles)
+    lengths = np.sqrt(np.einsum("ij,ij->i", normals, normals))
+    cosines = np.einsum("ij,ij->i", normals, right)
+    # Zero-area facets have no right-hand normal and always fail.
+    return (np.abs(lengths - 1) > tolerance) | (cosines < (1 - tolerance) * lengths)
+
+
+def positive_octant(triangles):
+    """Facets with a negative vertex coordinate."""
+    return _report("positive octant", _positive_octant(triangles))
+
+
+def orientation(triangles, normals, tolerance=TOLERANCE):
+    """Facets whose normal is not a unit vector following the right-hand rule."""
+    return _report("orientation", _orientation(triangles, normals, tolerance))
+
+
+def shared_edge(triangles):
+    """Facets with an edge that does not appear exactly twice."""
+    mesh = IndexedMesh.from_soup(triangles)
+    edges = mesh.edges().astype(np.int64)
+    keys = edges[:, 0] * len(mesh.vertices) + edges[:, 1]
+    _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    mask = np.any((counts[inverse] != 2).reshape(-1, 3), axis=1)
+    return _report("shared edge", mask)
+
+
+def ascending(triangles):
+    """Facets whose barycenter is below the one of the previous facet."""
+    z = triangles[:, :, 2].mean(axis=1)
+    mask = np.zeros(len(z), dtype=bool)
+    mask[1:] = np.diff(z) < 0
+    return _report("ascending", mask)
+
+
+def diagnose(triangles, normals, tolerance=TOLERANCE):
+    """Check all the rules on `(n, 3, 3)` triangles and `(n, 3)` normals."""
+    triangles = np.asarray(triangles, dtype=np.float32).reshape(-1, 3, 3)
+    return Report(
+        positive_octant(triangles),
+        orientation(triangles, normals, tolerance),
+        shared_edge(triangles),
+        ascending(triangles),
+    )
+
+
+def _members(count, total, squares):
+    """Recover the facets of edges with one or two facets.
+
+    The facets of an edge are known by their number, sum and sum of squares.
+    """
+    one = total[count == 1]
+    two = count == 2
+    total, squares = total[two], squares[two]
+    gap = np.rint(np.sqrt(2 * squares - total * total)).astype(np.int64)
+    return np.concatenate([one, (total - gap) // 2, (total + gap) // 2])
+
+
+class DiagnosticSession:
+    """Rule checks of a sequence of facets, updated by patches.
+
+    Facets are identified by ids that never change: the initial facets get
+    the ids 0 to n - 1 and added facets get new ids; rule reports list ids.
+    Each patch costs O(changed facets), with the global percentages kept up
+    to date; the vertices and edges are matched exactly, like in `shared_edge`.
+    """
+
+    RULES = Report._fields
+
+    def __init__(self, triangles, normals, tolerance=TOLERANCE):
+        triangles = np.asarray(triangles, dtype=np.float32).reshape(-1, 3, 3)
+        normals = np.asarray(normals, dtype=np.float32).reshape(-1, 3)
+        n = len(triangles)
+        self.tolerance = tolerance
+        self.head, self.tail = (0, n - 1) if n else (-1, -1)
+        self._size = self._count = n
+        self._triangles = triangles.copy()
+        self._normals = normals.copy()
+        self._z = triangles[:, :, 2].mean(axis=1)
+        self._alive = np.ones(n, dtype=bool)
+        self._prev = np.arange(-1, n - 1, dtype=np.int64)
+        self._next = np.arange(1, n + 1, dtype=np.int64)
+        self._next[-1:] = -1
+        self._flags = np.zeros((n, 4), dtype=bool)
+        self._flags[:, 0] = _positive_octant(triangles)
+        self._flags[:, 1] = _orientation(triangles, normals, tolerance)
+        self._flags[1:, 3] = np.diff(self._z) < 0
+
+        mesh = IndexedMesh.from_soup(triangles)
+        vertex_keys = (mesh.vertices + np.float32(0.0)).view("V12").ravel()
+        self._vertices = dict(zip(vertex_keys.tolist(), range(len(vertex_keys))))
+        edges = mesh.edges().astype(np.int64)
+        keys, slots = np.unique(edges[:, 0] << 32 | edges[:, 1], return_inverse=True)
+        self._edges = dict(zip(keys.tolist(), range(len(keys))))
+        self._slots = slots.reshape(-1, 3)
+        owners = np.repeat(np.arange(n, dtype=np.float64), 3)
+        self._edge_count = np.bincount(slots, minlength=len(keys))
+        self._edge_sum = np.bincount(slots, owners, len(keys)).astype(np.int64)
+        self._edge_squares = np.bincount(slots, owners**2, len(keys)).astype(np.int64)
+        self._flags[:, 2] = np.any(self._edge_count[self._slots] != 2, axis=1)
+        self._violations = np.count_nonzero(self._flags, axis=0)
+
+    def __len__(self):
+        return self._count
+
+    def percentages(self):
+        """Return the percentage of facets breaking each rule, in O(1)."""
+        count = max(self._count, 1)
+        return dict(zip(self.RULES, (100.0 * self._violations / count).tolist()))
+
+    def report(self):
+        """Return the full `Report`, where indices are facet ids."""
+        flags = self._flags[: self._size] & self._alive[: self._size, None]
+        count = max(self._count, 1)
+        return Report(
+            *(
+                RuleReport(rule.replace("_", " "), 100.0 * violations / count, ids)
+                for rule, violations, ids in zip(
+                    self.RULES, self._violations, map(np.flatnonzero, flags.T)
+                )
+            )
+        )
+
+    def ids(self):
+        """Return the ids of the facets, in sequence order."""
+        ids = np.empty(self._count, dtype=np.int64)
+        facet = self.head
+        for i in range(self._count):
+            ids[i] = facet
+            facet = self._next[facet]
+        return ids
+
+    def facets(self, ids=None):
+        """Return the triangles and normals of facets (all of them, in order)."""
+        ids = self.ids() if ids is None else np.asarray(ids)
+        return self._triangles[ids], self._normals[ids]
+
+    def add(self, triangles, normals=None, after=None):
+        """Insert facets after the facet `after` and return their ids.
+
+        By default, facets are added at the end; with `after=-1`, at the start.
+        """
+        if after is None:
+            after = self.tail
+        elif after >= 0:
+            self._existing([after])
+        triangles = np.asarray(triangles, dtype=np.float32).reshape(-1, 3, 3)
+        if normals is None:
+            normals = compute_normals(triangles)
+        ids = np.arange(self._size, self._size + len(triangles))
+        if len(ids) == 0:
+            return ids
+        self._reserve(self._size + len(ids))
+        self._size += len(ids)
+        self._count += len(ids)
+        self._alive[ids] = True
+        self._flags[ids] = False
+        self._store(ids, triangles, normals)
+
+        following = self._next[after] if after >= 0 else self.head
+        self._prev[ids] = np.concatenate([[after], ids[:-1]])
+        self._next[ids] = np.concatenate([ids[1:], [following]])
+        if after >= 0:
+            self._next[after] = ids[0]
+        else:
+            self.head = ids[0]
+        if following >= 0:
+            self._prev[following] = ids[-1]
+        else:
+            self.tail = ids[-1]
+
+        self._check(np.append(ids, self._link(ids, 1)), np.append(ids, following))
+        return ids
+
+    def remove(self, ids):
+        """Remove facets."""
+        ids = self._existing(ids)
+        affected = self._link(ids, -1)
+        for rule in range(len(self.RULES)):
+            self._set(ids, rule, False)
+        self._alive[ids] = False
+        self._count -= len(ids)
+        following = []
+        for facet in ids.tolist():
+            before, after = self._prev[facet], self._next[facet]
+            if before >= 0:
+                self._next[before] = after
+            else:
+                self.head = after
+            if after >= 0:
+                self._prev[after] = before
+            else:
+                self.tail = before
+            following.append(after)
+        self._check(affected, np.array(following, dtype=np.int64))
+
+    def modify(self, ids, triangles, normals=None):
+        """Replace the triangles (and normals) of facets."""
+        ids = self._existing(ids)
+        triangles = np.asarray(triangles, dtype=np.float32).reshape(-1, 3, 3)
+        if normals is None:
+            normals = compute_normals(triangles)
+        affected = [ids, self._link(ids, -1)]
+        self._store(ids, triangles, normals)
+        affected.append(self._link(ids, 1))
+        self._check(np.concatenate(affected), np.concatenate([ids, self._next[ids]]))
+
+    def _existing(self, ids):
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        if len(np.unique(ids)) != len(ids):
+            raise ValueError("duplicate facet ids")
+        if np.any((ids < 0) | (ids >= self._size)) or not np.all(self._alive[ids]):
+            raise ValueError("unknown facet ids")
+        return ids
+
+    def _reserve(self, size):
+        capacity = len(self._alive)
+        if size <= capacity:
+            return
+        capacity = max(size, 2 * capacity)
+        for name in ("_triangles", "_normals", "_z", "_alive", "_prev", "_next"):
+            setattr(self, name, _grow(getattr(self, name), capacity))
+        self._flags = _grow(self._flags, capacity)
+        self._slots = _grow(self._slots, capacity)
+
+    def _store(self, ids, triangles, normals):
+        self._triangles[ids] = triangles
+        self._normals[ids] = normals
+        self._z[ids] = triangles[:, :, 2].mean(axis=1)
+        self._set(ids, 0, _positive_octant(triangles))
+        self._set(ids, 1, _orientation(triangles, normals, self.tolerance))
+
+        vertices, edges = self._vertices, self._edges
+        keys = (triangles.reshape(-1, 3) + np.float32(0.0)).view("V12").ravel()
+        corners = [vertices.setdefault(key, len(vertices)) for key in keys.tolist()]
+        corners = np.reshape(corners, (-1, 3)).astype(np.int64)
+        pairs = np.sort(np.stack([corners, np.roll(corners, -1, axis=1)], axis=2))
+        keys = (pairs[..., 0] << 32 | pairs[..., 1]).ravel()
+        slots = [edges.setdefault(key, len(edges)) for key in keys.tolist()]
+        self._slots[ids] = np.reshape(slots, (-1, 3))
+        if len(edges) > len(self._edge_count):
+            capacity = max(len(edges), 2 * len(self._edge_count))
+            for name in ("_edge_count", "_edge_sum", "_edge_squares"):
+                setattr(self, name, _grow(getattr(self, name), capacity))
+
+    def _link(self, ids, sign):
+        """Add facets to their edges (or remove them, with `sign=-1`).
+
+        Return the facets whose shared edge rule may have changed.
+        """
+        slots = self._slots[ids].ravel()
+        owners = np.repeat(ids, 3)
+        touched = np.unique(slots)
+        members = [self._members(touched)]
+        np.add.at(self._edge_count, slots, sign)
+        np.add.at(self._edge_sum, slots, sign * owners)
+        np.add.at(self._edge_squares, slots, sign * owners * owners)
+        members.append(self._members(touched))
+        return np.concatenate(members)
+
+    def _members(self, slots):
+        return _members(
+            self._edge_count[slots], self._edge_sum[slots], self._edge_squares[slots]
+        )
+
+    def _set(self, ids, rule, values):
+        flags = self._flags[ids, rule]
+        change = np.count_nonzero(values) - np.count_nonzero(flags)
+        self._violations[rule] += change
+        self._flags[ids, rule] = values
+
+    def _check(self, facets, followers):
+        """Check the shared edge rule of facets, the ascending one of followers.
+
+        Ids may be repeated, negative (no facet) or removed.
+        """
+        facets = np.unique(facets)
+        facets = facets[self._alive[facets]]
+        broken = np.any(self._edge_count[self._slots[facets]] != 2, axis=1)
+        self._set(facets, 2, broken)
+        followers = np.unique(followers)
+        followers = followers[followers >= 0]
+        followers = followers[self._alive[followers]]
+        previous = self._prev[followers]
+        first = previous < 0
+        below = self._z[followers] < self._z[np.where(first, 0, previous)]
+        self._set(followers, 3, below & ~first)
+
+
+def _grow(array, capacity):
+    grown = np.zeros((capacity, *array.shape[1:]), dtype=array.dtype)
+    grown[: len(array)] = array
+    return grown
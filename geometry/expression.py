@@ -0,0 +1,294 @@
+"""Memoized CSG expressions over the sdf shapes and operations.
+
+Structurally identical subtrees are a single node, evaluated once per batch
+of points. A union member or a subtracted shape is skipped when the distance
+between its bounding box and the batch ensures that the result is unchanged.
+"""
+
+import threading
+import weakref
+
+import numpy as np
+import sdf
+from sdf.d3 import SDF3
+
+ORIGIN = (0.0, 0.0, 0.0)
+
+_nodes = weakref.WeakValueDictionary()
+
+
+class Stats:
+    """Evaluation counters of an expression."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.batches = 0
+        self.evaluations = 0
+        self.hits = 0
+        self.pruned = 0
+        self.samples = 0
+        self.saved = 0
+
+    def add(self, counts):
+        with self._lock:
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+
+    def __str__(self):
+        total = self.samples + self.saved
+        share = 100.0 * self.saved / total if total else 0.0
+        return (
+            f"{self.batches} batches, {self.evaluations} node evaluations, "
+            f"{self.hits} cache hits, {self.pruned} pruned subtrees; "
+            f"{self.samples} primitive samples, {self.saved} saved ({share:.1f}%)"
+        )
+
+
+def _canonical(value):
+    if value is None or isinstance(value, str):
+        return value
+    return np.shape(value), tuple(np.ravel(value).astype(float).tolist())
+
+
+def _make(cls, args, children=()):
+    key = (cls, tuple(_canonical(arg) for arg in args), tuple(map(id, children)))
+    node = _nodes.get(key)
+    if node is None:
+        node = _nodes[key] = cls(args, children)
+    return node
+
+
+def _distance(bounds, points):
+    """Distance between a bounding box and the bounding box of some points."""
+    lo, hi = bounds
+    gap = np.maximum(points.min(axis=0) - hi, lo - points.max(axis=0))
+    return float(np.linalg.norm(np.maximum(gap, 0.0)))
+
+
+class Node:
+    """A CSG expression, called on an (n, 3) array of points like a sdf shape.
+
+    The values of a shape are never smaller than the distance to its
+    `bounds`, from outside of them; `stats` count the evaluations. Identical
+    expressions are the same node and share their `stats`: reset them before
+    a run (`geometry.csg` meshing does).
+    """
+
+    def __init__(self, args, children=()):
+        self.args = args
+        self.children = children
+        self.size = sum(child.size for child in children) or 1
+        self.bounds = self._bounds()
+        self.stats = Stats()
+
+    def __call__(self, points):
+        points = np.asarray(points, dtype=np.float64)
+        counts = dict.fromkeys(["evaluations", "hits", "pruned", "samples", "saved"], 0)
+        counts["batches"] = 1
+        values = self._evaluate(points, {}, counts)
+        self.stats.add(counts)
+        return values.reshape((-1, 1))
+
+    def _evaluate(self, points, memo, counts):
+        key = (id(self), id(points))
+        if key in memo:
+            counts["hits"] += 1
+            counts["saved"] += len(points) * self.size
+            return memo[key][0]
+        values = self._compute(points, memo, counts)
+        # Keep the points alive, so that their id is not reused in the batch.
+        memo[key] = values, points
+        counts["evaluations"] += 1
+        return values
+
+    def __or__(self, other):
+        return union(self, other)
+
+    def __and__(self, other):
+        return intersection(self, other)
+
+    def __sub__(self, other):
+        return difference(self, other)
+
+    def orient(self, axis):
+        return orient(self, axis)
+
+    def rotate(self, angle, vector=(0.0, 0.0, 1.0)):
+        return rotate(self, angle, vector)
+
+    def translate(self, offset):
+        return translate(self, offset)
+
+    def sdf(self):
+        """Return the expression as a sdf shape."""
+        return SDF3(self)
+
+
+class Primitive(Node):
+    def _bounds(self):
+        name, *args = self.args
+        if name == "sphere":
+            radius, center = args
+            return np.subtract(center, radius), np.add(center, radius)
+        if name == "box":
+            size, center = args
+            return np.subtract(center, np.divide(size, 2)), np.add(
+                center, np.divide(size, 2)
+            )
+        if name == "cylinder":
+            (radius,) = args
+            return (-radius, -radius, -np.inf), (radius, radius, np.inf)
+        if name == "capped_cylinder":
+            a, b, radius = args
+            return np.minimum(a, b) - radius, np.maximum(a, b) + radius
+        if name == "capped_cone":
+            a, b, ra, rb = args
+            radius = max(ra, rb)
+            return np.minimum(a, b) - radius, np.maximum(a, b) + radius
+        if name == "torus":
+            r1, r2 = args
+            return (-r1 - r2, -r1 - r2, -r2), (r1 + r2, r1 + r2, r2)
+        return np.full(3, -np.inf), np.full(3, np.inf)
+
+    def _compute(self, points, memo, counts):
+        if not hasattr(self, "_shape"):
+            name, *args = self.args
+            self._shape = getattr(sdf, name)(*args)
+        counts["samples"] += len(points)
+        return self._shape(points)
+
+
+class Union(Node):
+    def _bounds(self):
+        return (
+            np.min([child.bounds[0] for child in self.children], axis=0),
+            np.max([child.bounds[1] for child in self.children], axis=0),
+        )
+
+    def _compute(self, points, memo, counts):
+        distances = [_distance(child.bounds, points) for child in self.children]
+        values = None
+        for index in np.argsort(distances, kind="stable"):
+            child, distance = self.children[index], distances[index]
+            if values is not None and 0 < distance and values.max() <= distance:
+                counts["pruned"] += 1
+                counts["saved"] += len(points) * child.size
+                continue
+            child_values = child._evaluate(points, memo, counts)
+            if values is not None:
+                child_values = np.minimum(values, child_values)
+            values = child_values
+        return values
+
+
+class Intersection(Node):
+    def _bounds(self):
+        # The maximum is bounded below by the distance to any child bounds,
+        # but not by the distance to their intersection: pick the smallest.
+        volumes = [np.prod(np.subtract(*child.bounds[::-1])) for child in self.children]
+        return self.children[int(np.argmin(volumes))].bounds
+
+    def _compute(self, points, memo, counts):
+        values = self.children[0]._evaluate(points, memo, counts)
+        for child in self.children[1:]:
+            values = np.maximum(values, child._evaluate(points, memo, counts))
+        return values
+
+
+class Difference(Node):
+    def _bounds(self):
+        return self.children[0].bounds
+
+    def _compute(self, points, memo, counts):
+        values = self.children[0]._evaluate(points, memo, counts)
+        for child in self.children[1:]:
+            distance = _distance(child.bounds, points)
+            if 0 < distance and -values.min() <= distance:
+                counts["pruned"] += 1
+                counts["saved"] += len(points) * child.size
+                continue
+            values = np.maximum(values, -child._evaluate(points, memo, counts))
+        return values
+
+
+class Transform(Node):
+    """A sdf transform, probed once as the affine map `points @ matrix + offset`."""
+
+    def _bounds(self):
+        name, *args = self.args
+        probe = []
+        shape = getattr(sdf, name)(SDF3(lambda q: probe.append(q) or q[:, 0]), *args)
+        shape(np.vstack([np.zeros(3), np.eye(3)]))
+        self.offset = probe[0][0]
+        self.matrix = probe[0][1:] - self.offset
+        # Map the child bounds back: points = (q - offset) @ inverse.
+        lo, hi = np.asarray(self.children[0].bounds, dtype=np.float64)
+        half = (hi - lo) / 2
+        inverse = np.linalg.inv(self.matrix)
+        weights = np.abs(inverse)
+        # Rounding errors must not spread an infinite extent to the other axes.
+        weights[np.isinf(half)[:, None] & (weights < 1e-9)] = 0.0
+        with np.errstate(invalid="ignore"):
+            center = np.where(np.isfinite(half), lo + half, 0.0)
+            half = np.where(weights > 0, weights * half[:, None], 0.0).sum(axis=0)
+        center = (center - self.offset) @ inverse
+        return center - half, center + half
+
+    def _compute(self, points, memo, counts):
+        return self.children[0]._evaluate(
+            points @ self.matrix + self.offset, memo, counts
+        )
+
+
+def sphere(radius=1.0, center=ORIGIN):
+    return _make(Primitive, ("sphere", radius, center))
+
+
+def box(size=1.0, center=ORIGIN, a=None, b=None):
+    if a is not None and b is not None:
+        size = np.subtract(b, a)
+        center = np.add(a, size / 2)
+    return _make(Primitive, ("box", size, center))
+
+
+def cylinder(radius):
+    return _make(Primitive, ("cylinder", radius))
+
+
+def capped_cylinder(a, b, radius):
+    return _make(Primitive, ("capped_cylinder", a, b, radius))
+
+
+def capped_cone(a, b, ra, rb):
+    return _make(Primitive, ("capped_cone", a, b, ra, rb))
+
+
+def torus(r1, r2):
+    return _make(Primitive, ("torus", r1, r2))
+
+
+def union(a, *bs):
+    return _make(Union, (), (a, *bs))
+
+
+def intersection(a, *bs):
+    return _make(Intersection, (), (a, *bs))
+
+
+def difference(a, *bs):
+    return _make(Difference, (), (a, *bs))
+
+
+def orient(other, axis):
+    return _make(Transform, ("orient", axis), (other,))
+
+
+def rotate(other, angle, vector=(0.0, 0.0, 1.0)):
+    return _make(Transform, ("rotate", angle, vector), (other,))
+
+
+def translate(other, offset):
+    return _make(Transform, ("translate", offset), (other,))
@@ -0,0 +1,299 @@
+"""Conversion of JupyterCAD (.jcad) documents to STL.
+
+The object tree is compiled into a `geometry.expression` shape. For meshing,
+the shape of every object is sampled on the lattice of multiples of the step,
+within its bounds and a margin; boolean objects combine the fields of their
+operands. The fields are cached on the hash of the object subtree, so after
+an edit only the changed objects (and the booleans above them) are sampled
+or combined again.
+
+Outside of the field of an operand, its values are replaced by the margin:
+this never changes the sign of the result, nor its values at the corners of
+the cells crossed by the surface, hence the mesh is the same as the one of
+the shape sampled on the whole lattice.
+"""
+
+import collections
+import hashlib
+import json
+import math
+import os
+import time
+from multiprocessing.pool import ThreadPool
+from typing import NamedTuple
+
+import numpy as np
+from sdf.mesh import _cartesian_product, _marching_cubes
+
+from . import expression
+from .stl import write_binary_stl
+
+MARGIN = 2
+MAX_BYTES = 1 << 30
+SLAB = 8
+WORKERS = os.cpu_count()
+
+BOOLEANS = {
+    "Part::Cut": expression.difference,
+    "Part::Fuse": expression.union,
+    "Part::MultiFuse": expression.union,
+    "Part::Common": expression.intersection,
+    "Part::MultiCommon": expression.intersection,
+}
+# Angles (in degrees) of the complete primitives; others are partial solids.
+FULL_ANGLES = {
+    "Part::Sphere": {"Angle1": -90.0, "Angle2": 90.0, "Angle3": 360.0},
+    "Part::Cylinder": {"Angle": 360.0},
+    "Part::Cone": {"Angle": 360.0},
+    "Part::Torus": {"Angle": 360.0, "Angle1": -180.0, "Angle2": 180.0, "Angle3": 360.0},
+}
+COMBINE = {
+    expression.difference: lambda base, *tools: np.maximum.reduce(
+        [base] + [-tool for tool in tools]
+    ),
+    expression.union: lambda *fields: np.minimum.reduce(fields),
+    expression.intersection: lambda *fields: np.maximum.reduce(fields),
+}
+
+
+def read_jcad(file):
+    """Read a JupyterCAD document from a path or a text file object."""
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, encoding="utf-8") as f:
+            return json.load(f)
+    return json.load(file)
+
+
+def _operands(obj):
+    parameters = obj["parameters"]
+    if obj["shape"] in ("Part::Cut", "Part::Fuse", "Part::Common"):
+        return [parameters["Base"], parameters["Tool"]]
+    return list(parameters["Shapes"])
+
+
+def _placement(obj):
+    placement = obj["parameters"].get("Placement", {})
+    return placement.get("Position", (0.0, 0.0, 0.0)), placement.get("Angle", 0.0)
+
+
+def _place(shape, obj):
+    position, angle = _placement(obj)
+    if angle:
+        axis = obj["parameters"]["Placement"].get("Axis", (0.0, 0.0, 1.0))
+        shape = shape.rotate(math.radians(angle), axis)
+    if any(position):
+        shape = shape.translate(position)
+    return shape
+
+
+def _primitive(obj):
+    shape, parameters = obj["shape"], obj["parameters"]
+    for key, angle in FULL_ANGLES.get(shape, {}).items():
+        if not math.isclose(parameters.get(key, angle), angle):
+            raise ValueError(f"unsupported partial JupyterCAD shape {shape!r}")
+    if shape == "Part::Box":
+        size = np.array([parameters[key] for key in ("Length", "Width", "Height")])
+        return expression.box(size, center=size / 2)
+    if shape == "Part::Sphere":
+        return expression.sphere(parameters["Radius"])
+    if shape == "Part::Cylinder":
+        height = (0.0, 0.0, parameters["Height"])
+        return expression.capped_cylinder((0.0, 0.0, 0.0), height, parameters["Radius"])
+    if shape == "Part::Cone":
+        height = (0.0, 0.0, parameters["Height"])
+        return expression.capped_cone(
+            (0.0, 0.0, 0.0), height, parameters["Radius1"], parameters["Radius2"]
+        )
+    if shape == "Part::Torus":
+        return expression.torus(parameters["Radius1"], parameters["Radius2"])
+    raise ValueError(f"unsupported JupyterCAD shape {shape!r}")
+
+
+class Document:
+    """A JupyterCAD document, compiled into CSG expressions object by object."""
+
+    def __init__(self, document):
+        self.objects = {obj["name"]: obj for obj in document["objects"]}
+        operands = {
+            name
+            for obj in self.objects.values()
+            if obj["shape"] in BOOLEANS
+            for name in _operands(obj)
+        }
+        self.roots = [name for name in self.objects if name not in operands]
+        self._trees = {}
+        self._shapes = {}
+
+    def tree(self, name):
+        """Return the JSON text of an object, with its operands inlined."""
+        if name not in self._trees:
+            obj = self.objects[name]
+            parameters = {
+                key: value
+                for key, value in obj["parameters"].items()
+                if key not in ("Color", "Base", "Tool", "Shapes")
+            }
+            operands = []
+            if obj["shape"] in BOOLEANS:
+                operands = [json.loads(self.tree(name)) for name in _operands(obj)]
+            tree = {
+                "shape": obj["shape"],
+                "parameters": parameters,
+                "operands": operands,
+            }
+            self._trees[name] = json.dumps(tree, sort_keys=True)
+        return self._trees[name]
+
+    def shape(self, name=None):
+        """Return the expression of an object, or the union of the roots."""
+        if name is None:
+            return expression.union(*map(self.shape, self.roots))
+        if name not in self._shapes:
+            obj = self.objects[name]
+            if obj["shape"] in BOOLEANS:
+                operation = BOOLEANS[obj["shape"]]
+                shape = operation(*map(self.shape, _operands(obj)))
+            else:
+                shape = _primitive(obj)
+            self._shapes[name] = _place(shape, obj)
+        return self._shapes[name]
+
+
+class Field(NamedTuple):
+    start: tuple
+    values: np.ndarray
+
+    @property
+    def stop(self):
+        return tuple(np.add(self.start, self.values.shape))
+
+
+class FieldCache:
+    """LRU cache of sampled fields, keyed on object subtrees and steps."""
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = self.misses = 0
+        self._fields = collections.OrderedDict()
+
+    def get(self, key, build):
+        field = self._fields.get(key)
+        if field is not None:
+            self.hits += 1
+            self._fields.move_to_end(key)
+            return field
+        self.misses += 1
+        field = build()
+        self._fields[key] = field
+        self.nbytes += field.values.nbytes
+        while self.nbytes > self.max_bytes and len(self._fields) > 1:
+            _, evicted = self._fields.popitem(last=False)
+            self.nbytes -= evicted.values.nbytes
+        return field
+
+    def clear(self):
+        self._fields.clear()
+        self.nbytes = 0
+
+
+cache = FieldCache()
+
+
+def _lattice(shape, step):
+    lo, hi = shape.bounds
+    if not np.all(np.isfinite([lo, hi])):
+        raise ValueError("unbounded JupyterCAD shape")
+    start = np.floor(np.divide(lo, step)).astype(int) - MARGIN
+    stop = np.ceil(np.divide(hi, step)).astype(int) + MARGIN + 1
+    return tuple(start.tolist()), tuple(stop.tolist())
+
+
+def _sample(shape, start, stop, step, workers):
+    X, Y, Z = (np.arange(i, j) * step for i, j in zip(start, stop))
+
+    def slab(xs):
+        return shape(_cartesian_product(xs, Y, Z)).reshape((len(xs), len(Y), len(Z)))
+
+    slabs = [X[i : i + SLAB] for i in range(0, len(X), SLAB)]
+    with ThreadPool(workers) as pool:
+        return Field(start, np.concatenate(pool.map(slab, slabs)))
+
+
+def _crop(field, start, stop, step):
+    """Return the values of a field on a box, the margin value outside."""
+    values = np.full(np.subtract(stop, start), MARGIN * step, dtype=field.values.dtype)
+    lo = np.maximum(start, field.start)
+    hi = np.minimum(stop, field.stop)
+    if np.all(lo < hi):
+        target = tuple(slice(i - j, k - j) for i, j, k in zip(lo, start, hi))
+        source = tuple(slice(i - j, k - j) for i, j, k in zip(lo, field.start, hi))
+        values[target] = field.values[source]
+    return values
+
+
+class Stats(NamedTuple):
+    facets: int
+    computed: int
+    reused: int
+    seconds: float
+
+    def __str__(self):
+        return (
+            f"{self.facets} facets, {self.computed} fields computed, "
+            f"{self.reused} reused: {self.seconds:.2f} s"
+        )
+
+
+def _field(document, name, step, workers, cache):
+    """Return the field of an object, or of the union of the roots."""
+    if name is None and len(document.roots) == 1:
+        name = document.roots[0]
+    if name is None:
+        trees = [document.tree(root) for root in document.roots]
+        operation, operands = expression.union, document.roots
+    else:
+        trees = [document.tree(name)]
+        obj = document.objects[name]
+        position, angle = _placement(obj)
+        operation = operands = None
+        # Without placement, the fields of the operands are reused.
+        if obj["shape"] in BOOLEANS and not angle and not any(position):
+            operation, operands = BOOLEANS[obj["shape"]], _operands(obj)
+    shape = document.shape(name)
+    start, stop = _lattice(shape, step)
+    digest = hashlib.sha256(json.dumps([trees, step]).encode()).hexdigest()
+
+    def build():
+        if operation is None:
+            return _sample(shape, start, stop, step, workers)
+        values = [
+            _crop(_field(document, operand, step, workers, cache), start, stop, step)
+            for operand in operands
+        ]
+        return Field(start, COMBINE[operation](*values))
+
+    return cache.get(digest, build)
+
+
+def jcad_to_stl(jcad_file, stl_file, step=0.02, workers=WORKERS, cache=cache):
+    """Convert a JupyterCAD document to a binary STL file; return the `Stats`.
+
+    The document objects that are not operands of a boolean are merged.
+    """
+    start = time.perf_counter()
+    hits, misses = cache.hits, cache.misses
+    document = Document(read_jcad(jcad_file))
+    field = _field(document, None, step, workers, cache)
+    try:
+        points = _marching_cubes(field.values)
+    except (RuntimeError, ValueError):
+        points = np.empty((0, 3))
+    triangles = (points + field.start) * step
+    write_binary_stl(stl_file, triangles.reshape((-1, 3, 3)))
+    return Stats(
+        len(triangles) // 3,
+        cache.misses - misses,
+        cache.hits - hits,
+        time.perf_counter() - start,
+    )
@@ -0,0 +1,85 @@
+"""Level of detail: mesh simplification by vertex clustering."""
+
+import numpy as np
+
+from .mesh import IndexedMesh, _unique_rows
+from .normals import compute_normals
+
+
+def _quadric_positions(mesh, clusters, count, means, cell, corner):
+    # Position minimizing the (area-weighted) squared distances to the planes
+    # of the faces around each cluster, kept within the cluster cell.
+    triangles = mesh.vertices[mesh.faces].astype(np.float64)
+    normals = compute_normals(triangles, normalize=False)
+    planes = np.empty((len(normals), 4))
+    planes[:, :3] = normals
+    planes[:, 3] = -np.einsum("ij,ij->i", normals, triangles[:, 0])
+    # The plane normals have a length of twice the area: normalize once and
+    # weight by the area.
+    areas = np.linalg.norm(normals, axis=1) / 2
+    planes /= np.where(areas > 0, 2 * areas, 1)[:, np.newaxis]
+    quadrics = np.einsum("i,ij,ik->ijk", areas, planes, planes)
+    Q = np.zeros((count, 4, 4))
+    for j in range(3):
+        np.add.at(Q, clusters[mesh.faces[:, j]], quadrics)
+    inverses = np.linalg.pinv(Q[:, :3, :3], rcond=1e-6)
+    positions = -np.einsum("ijk,ik->ij", inverses, Q[:, :3, 3])
+    low = corner + np.floor((means - corner) / cell) * cell
+    outside = np.any((positions < low) | (positions > low + cell), axis=1)
+    positions[outside] = means[outside]
+    return positions
+
+
+def cluster(mesh, cell, quadric=False):
+    """Merge the vertices of each cell of a grid of spacing `cell`.
+
+    Clusters are placed at the mean of their vertices, or with `quadric=True`
+    at the point minimizing the quadric error of the surrounding faces.
+    """
+    vertices = mesh.vertices.astype(np.float64)
+    corner = vertices.min(axis=0)
+    keys = np.floor((vertices - corner) / cell).astype(np.int64)
+    _, clusters = _unique_rows(keys)
+    count = clusters.max() + 1
+    sizes = np.bincount(clusters, minlength=count)[:, np.newaxis]
+    means = (
+        np.stack(
+            [np.bincount(clusters, vertices[:, k], minlength=count) for k in range(3)],
+            axis=1,
+        )
+        / sizes
+    )
+    positions = means
+    if quadric:
+        positions = _quadric_positions(mesh, clusters, count, means, cell, corner)
+
+    faces = clusters[mesh.faces]
+    degenerate = (
+        (faces[:, 0] == faces[:, 1])
+        | (faces[:, 1] == faces[:, 2])
+        | (faces[:, 2] == faces[:, 0])
+    )
+    faces = faces[~degenerate]
+    # Faces that collapse onto the same three clusters are kept once.
+    index, _ = _unique_rows(np.sort(faces, axis=1))
+    faces = faces[np.sort(index)]
+
+    used = np.zeros(count, dtype=bool)
+    used[faces] = True
+    renumber = np.cumsum(used) - 1
+    return IndexedMesh(positions[used], renumber[faces])
+
+
+def decimate(mesh, max_faces, quadric=False):
+    """Simplify a mesh by clustering until it has at most `max_faces` faces."""
+    if len(mesh.faces) <= max_faces:
+        return mesh
+    extent = np.ptp(mesh.vertices, axis=0).max()
+    # Face counts fall roughly like the square of the cell size.
+    edges = mesh.vertices[mesh.faces] - mesh.vertices[np.roll(mesh.faces, 1, axis=1)]
+    cell = np.linalg.norm(edges, axis=2).mean() * np.sqrt(len(mesh.faces) / max_faces)
+    while True:
+        simplified = cluster(mesh, cell, quadric)
+        if len(simplified.faces) <= max_faces or cell > extent:
+            return simplified
+        cell *= 1.05 * np.sqrt(len(simplified.faces) / max_faces)
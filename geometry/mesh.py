@@ -0,0 +1,61 @@
+"""Indexed triangle meshes."""
+
+import numpy as np
+
+
+def _unique_rows(keys):
+    # Return (index of one representative row per group, group of each row)
+    # for the distinct rows of an (n, 3) integer array.
+    order = np.lexsort((keys[:, 2], keys[:, 1], keys[:, 0]))
+    keys = keys[order]
+    first = np.empty(len(keys), dtype=bool)
+    first[:1] = True
+    np.any(keys[1:] != keys[:-1], axis=1, out=first[1:])
+    inverse = np.empty(len(keys), dtype=np.int32)
+    inverse[order] = np.cumsum(first, dtype=np.int32) - 1
+    return order[first], inverse
+
+
+class IndexedMesh:
+    """Triangle mesh as `(V, 3)` float32 vertices and `(F, 3)` int32 faces."""
+
+    __slots__ = ("faces", "vertices")
+
+    def __init__(self, vertices, faces):
+        self.vertices = np.ascontiguousarray(vertices, dtype=np.float32).reshape(-1, 3)
+        self.faces = np.ascontiguousarray(faces, dtype=np.int32).reshape(-1, 3)
+
+    @classmethod
+    def from_soup(cls, triangles, tolerance=None):
+        """Weld the vertices of `(n, 3, 3)` triangles.
+
+        Vertices are merged when they are exactly equal or, if `tolerance` is
+        given, when they fall in the same cell of a grid of that spacing.
+        """
+        points = np.asarray(triangles, dtype=np.float32).reshape(-1, 3)
+        if tolerance is None:
+            # Bit patterns, once -0.0 is replaced by 0.0.
+            keys = (points + np.float32(0.0)).view(np.uint32)
+        else:
+            keys = np.floor(points / tolerance).astype(np.int64)
+        index, inverse = _unique_rows(keys)
+        return cls(points[index], inverse.reshape(-1, 3))
+
+    def to_soup(self):
+        """Return the `(F, 3, 3)` array of the triangle vertices."""
+        return self.vertices[self.faces]
+
+    def edges(self):
+        """Return the `(3 * F, 2)` vertex pairs of the face edges, sorted by row.
+
+        Row `3 * i + j` is the edge from corner `j` to corner `j + 1` of face `i`.
+        """
+        edges = np.stack([self.faces, np.roll(self.faces, -1, axis=1)], axis=2)
+        return np.sort(edges.reshape(-1, 2), axis=1)
+
+    @property
+    def nbytes(self):
+        return self.vertices.nbytes + self.faces.nbytes
+
+    def __repr__(self):
+        return f"IndexedMesh({len(self.vertices)} vertices, {len(self.faces)} faces)"
@@ -0,0 +1,47 @@
+"""Facet normals of triangle arrays."""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Facets per task when the work is split across threads.
+CHUNK_SIZE = 1 << 20
+
+
+def _normals(triangles, normalize, out):
+    v0 = triangles[:, 0]
+    out[:] = np.cross(triangles[:, 1] - v0, triangles[:, 2] - v0)
+    if normalize:
+        norms = np.sqrt(np.einsum("ij,ij->i", out, out))[:, np.newaxis]
+        # Degenerate (zero-area) facets keep a zero normal.
+        np.divide(out, norms, out=out, where=norms > 0)
+
+
+def compute_normals(triangles, normalize=True, out=None, workers=1):
+    """Compute the right-hand rule normals of `(n, 3, 3)` triangles.
+
+    The result is written into `out` when it is given. With `workers > 1`,
+    chunks of facets are processed by a thread pool (NumPy releases the GIL).
+    """
+    triangles = np.asarray(triangles)
+    if triangles.dtype.kind != "f":
+        triangles = triangles.astype(np.float32)
+    triangles = triangles.reshape(-1, 3, 3)
+    n = len(triangles)
+    if out is None:
+        out = np.empty((n, 3), dtype=triangles.dtype)
+    elif out.shape != (n, 3):
+        raise ValueError(f"out has shape {out.shape}, expected {(n, 3)}")
+    if workers <= 1 or n <= CHUNK_SIZE:
+        _normals(triangles, normalize, out)
+        return out
+    with ThreadPoolExecutor(workers) as executor:
+        tasks = []
+        for i in range(0, n, CHUNK_SIZE):
+            chunk = slice(i, i + CHUNK_SIZE)
+            tasks.append(
+                executor.submit(_normals, triangles[chunk], normalize, out[chunk])
+            )
+        for task in tasks:
+            task.result()
+    return out
@@ -0,0 +1,234 @@
+"""OBJ file format: reader, writer and conversions to and from STL."""
+
+import re
+from typing import NamedTuple
+
+import numpy as np
+
+from .mesh import IndexedMesh
+from .stl import BLOCK_SIZE, StlWriter, _float_args, _float_format, _open, read_stl
+
+
+class ObjMesh(NamedTuple):
+    """Arrays of an OBJ file; all indices are 0-based.
+
+    Face `i` has `face_sizes[i]` corners, stored consecutively in
+    `face_vertices` (and in `face_texcoords` / `face_normals` when the faces
+    refer to texture coordinates / normals, `None` otherwise). In files that
+    mix face layouts, the corners without texture coordinates / normals have
+    the index -1.
+    """
+
+    vertices: np.ndarray
+    texcoords: np.ndarray
+    normals: np.ndarray
+    face_vertices: np.ndarray
+    face_texcoords: np.ndarray
+    face_normals: np.ndarray
+    face_sizes: np.ndarray
+
+
+# Statement bodies, by statement keyword (comments excluded). The patterns
+# start with a literal newline, which `re` searches much faster than `^`;
+# the data is read with a newline prepended.
+STATEMENTS = {
+    keyword: re.compile(rb"\n" + keyword + rb"[ \t]+([^\r\n#]*)")
+    for keyword in (b"v", b"vt", b"vn", b"f")
+}
+
+
+def _statements(data, keyword):
+    if b"\n" + keyword not in data:
+        return []
+    return STATEMENTS[keyword].findall(data)
+
+
+# Fewest fields of the element statements (texture coordinates v and w
+# default to 0).
+MIN_FIELDS = {b"v": 3, b"vt": 1, b"vn": 3}
+
+# Face corner layouts, by slashes + 3 * double slashes per corner.
+LAYOUTS = {0: ("v",), 1: ("v", "vt"), 2: ("v", "vt", "vn"), 5: ("v", "vn")}
+
+
+def _line_counts(lines, slashes=False):
+    # Return the number of fields of each line (and of slashes and double
+    # slashes), from the positions of the field starts (and slashes).
+    text = np.frombuffer(b"\n".join(lines) + b"\n", dtype=np.uint8)
+    end = text == ord("\n")
+    bounds = np.concatenate([[0], np.flatnonzero(end) + 1])
+    blank = end | (text == ord(" ")) | (text == ord("\t"))
+    masks = [~blank & np.concatenate([[True], blank[:-1]])]
+    if slashes:
+        slash = text == ord("/")
+        masks += [slash, np.concatenate([slash[:-1] & slash[1:], [False]])]
+    counts = [np.diff(np.searchsorted(np.flatnonzero(m), bounds)) for m in masks]
+    return tuple(counts) if slashes else counts[0]
+
+
+def _groups(lines, keys):
+    # Yield the key, rows and lines of the groups of lines with the same key.
+    if np.all(keys == keys[0]):
+        yield keys[0], slice(None), lines
+        return
+    for key in np.unique(keys):
+        rows = np.flatnonzero(keys == key)
+        yield key, rows, [lines[i] for i in rows]
+
+
+def _floats(data, keyword, width):
+    lines = _statements(data, keyword)
+    if not lines:
+        return np.empty((0, width), dtype=np.float32)
+    fields = _line_counts(lines)
+    if np.any(fields < MIN_FIELDS[keyword]):
+        raise ValueError(f"missing fields in '{keyword.decode()}' lines")
+    values = np.zeros((len(lines), min(width, fields.max())), dtype=np.float32)
+    # Lines are converted by field count; extra fields (weights, vertex
+    # colors) are dropped.
+    for count, rows, group in _groups(lines, fields):
+        block = np.fromstring(b" ".join(group), dtype=np.float32, sep=" ")
+        if block.size != count * len(group):
+            raise ValueError(f"malformed '{keyword.decode()}' line")
+        values[rows, :count] = block.reshape(len(group), count)[:, : values.shape[1]]
+    return values
+
+
+def _positions(data, keyword):
+    return np.array([m.start() for m in STATEMENTS[keyword].finditer(data)])
+
+
+def _face_corners(lines, width):
+    # Return the `(corners, width)` indices and the sizes of faces of a layout.
+    # Indices are never 0 in OBJ files: 0 marks the end of each face.
+    text = b" 0 ".join(lines) + b" 0"
+    text = text.replace(b"//", b" ").replace(b"/", b" ")
+    values = np.fromstring(text, dtype=np.int64, sep=" ")
+    ends = np.flatnonzero(values == 0)
+    if len(ends) != len(lines):
+        raise ValueError("malformed 'f' line")
+    sizes = np.diff(ends, prepend=-1) - 1
+    if np.any(sizes % width) or np.any(sizes < 3 * width):
+        raise ValueError("malformed 'f' line")
+    return np.delete(values, ends).reshape(-1, width), sizes // width
+
+
+def _faces(data):
+    # Return the (corners, fields) index array, the face sizes and the fields;
+    # the indices of the fields a face does not refer to are 0.
+    lines = _statements(data, b"f")
+    if not lines:
+        return np.empty((0, 1), dtype=np.int64), np.empty(0, dtype=np.int32), ["v"]
+    corners, slashes, doubles = _line_counts(lines, slashes=True)
+    layouts = slashes // np.maximum(corners, 1) + 3 * doubles // np.maximum(corners, 1)
+    uniform = (slashes + 3 * doubles == layouts * corners) & (corners > 0)
+    if not np.all(uniform & np.isin(layouts, list(LAYOUTS))):
+        raise ValueError("'f' line with no corners or with mixed corner layouts")
+    groups = [
+        (LAYOUTS[layout], rows, *_face_corners(group, len(LAYOUTS[layout])))
+        for layout, rows, group in _groups(lines, layouts)
+    ]
+    if len(groups) == 1:
+        fields, _, corners, sizes = groups[0]
+        return corners, sizes.astype(np.int32), list(fields)
+    present = {field for layout, *_ in groups for field in layout}
+    fields = [field for field in ("v", "vt", "vn") if field in present]
+    sizes = np.empty(len(lines), dtype=np.int32)
+    for _, rows, _, group_sizes in groups:
+        sizes[rows] = group_sizes
+    starts = np.cumsum(sizes) - sizes
+    result = np.zeros((sizes.sum(), len(fields)), dtype=np.int64)
+    for layout, rows, group_corners, group_sizes in groups:
+        # Corner k of a face goes to its start in the file order plus k.
+        offsets = np.cumsum(group_sizes) - group_sizes
+        k = np.arange(len(group_corners)) - np.repeat(offsets, group_sizes)
+        columns = [fields.index(field) for field in layout]
+        positions = np.repeat(starts[rows], group_sizes) + k
+        result[positions[:, None], columns] = group_corners
+    return result, sizes, fields
+
+
+def read_obj(file):
+    """Read the vertices, texture coordinates, normals and faces of an OBJ file."""
+    with _open(file, "rb") as f:
+        data = b"\n" + f.read()
+    elements = {
+        "v": _floats(data, b"v", 3),
+        "vt": _floats(data, b"vt", 3),
+        "vn": _floats(data, b"vn", 3),
+    }
+    corners, sizes, fields = _faces(data)
+    if np.any(corners < 0):
+        lines = np.repeat(_positions(data, b"f"), sizes)
+    indices = {}
+    for column, field in enumerate(fields):
+        count = len(elements[field])
+        if np.any(corners[:, column] < 0):
+            # Negative indices are relative to the count at the face line.
+            count = np.searchsorted(_positions(data, field.encode()), lines)
+        index = corners[:, column]
+        missing = index == 0
+        index = np.where(index < 0, count + index, index - 1).astype(np.int32)
+        if np.any((index < 0) & ~missing) or np.any(index >= len(elements[field])):
+            raise ValueError(f"'{field}' index out of range in 'f' line")
+        indices[field] = index
+    return ObjMesh(
+        elements["v"],
+        elements["vt"],
+        elements["vn"],
+        indices["v"],
+        indices.get("vt"),
+        indices.get("vn"),
+        sizes,
+    )
+
+
+def triangulate(face_vertices, face_sizes):
+    """Split polygonal faces into `(T, 3)` triangle fans."""
+    face_sizes = np.asarray(face_sizes)
+    starts = np.cumsum(face_sizes) - face_sizes
+    fans = face_sizes - 2
+    face = np.repeat(np.arange(len(face_sizes)), fans)
+    # Triangle k of a face is made of its corners 0, k + 1 and k + 2.
+    k = np.arange(len(face)) - np.repeat(np.cumsum(fans) - fans, fans)
+    first = starts[face]
+    corners = np.stack([first, first + k + 1, first + k + 2], axis=1)
+    return np.asarray(face_vertices, dtype=np.int32)[corners]
+
+
+def obj_to_stl(file_in, file_out, binary=False, name="", format="repr", precision=None):
+    """Convert an OBJ file to an (ASCII or binary) STL file."""
+    obj = read_obj(file_in)
+    faces = triangulate(obj.face_vertices, obj.face_sizes)
+    options = {"format": format, "precision": precision}
+    with StlWriter(file_out, binary=binary, name=name, **options) as writer:
+        for start in range(0, len(faces), BLOCK_SIZE):
+            writer.write(obj.vertices[faces[start : start + BLOCK_SIZE]])
+
+
+def write_obj(file, vertices, faces, format="shortest", precision=None):
+    """Write `(V, 3)` vertices and `(F, k)` 0-based faces to an OBJ file.
+
+    The floats are written as in `geometry.stl.write_ascii_stl`; by default,
+    with the shortest text that reads back as the same float32 values.
+    """
+    spec = _float_format(format, precision)
+    vertices = np.asarray(vertices, dtype=np.float32).reshape(-1, 3)
+    faces = np.asarray(faces).reshape(len(faces), -1)
+    with _open(file, "wt", encoding="utf-8", newline="\n") as f:
+        f.write(f"# vertex count = {len(vertices)}\n# face count = {len(faces)}\n")
+        for start in range(0, len(vertices), BLOCK_SIZE):
+            block = vertices[start : start + BLOCK_SIZE]
+            template, args = _float_args(block, spec)
+            f.write((f"v {template} {template} {template}\n" * len(block)) % args)
+        template = "f" + " %d" * faces.shape[1] + "\n"
+        for start in range(0, len(faces), BLOCK_SIZE):
+            block = faces[start : start + BLOCK_SIZE] + 1
+            f.write((template * len(block)) % tuple(block.ravel().tolist()))
+
+
+def stl_to_obj(file_in, file_out, format="shortest", precision=None):
+    """Convert an STL file to OBJ, welding the shared vertices."""
+    triangles, _ = read_stl(file_in)
+    mesh = IndexedMesh.from_soup(triangles)
+    write_obj(file_out, mesh.vertices, mesh.faces, format, precision)
@@ -0,0 +1,125 @@
+"""Matplotlib rendering of meshes, interactive or headless."""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import NamedTuple
+
+import matplotlib
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from mpl3d import glm
+from mpl3d.camera import Camera
+from mpl3d.mesh import Mesh
+
+from .cache import load_mesh
+from .culling import cull as cull_faces
+
+DPI = 100
+MAX_FACES = 20_000
+VIEWS = [(45.0, 30.0), (-45.0, 30.0), (135.0, -30.0)]
+OUTPUT = os.path.join("output", "thumbnails")
+
+
+def draw(
+    ax,
+    mesh,
+    theta=0.0,
+    phi=0.0,
+    scale=1.0,
+    colormap="viridis",
+    edgecolors=(0, 0, 0, 0.25),
+    cull=False,
+):
+    """Draw an `IndexedMesh` in an axes spanning [-1, 1] x [-1, 1].
+
+    With `cull`, back-facing faces and faces smaller than half a pixel are
+    not drawn; the culling stats are returned. Back-face culling assumes
+    outward, counter-clockwise facets: misoriented facets and the interior
+    of open meshes are not drawn.
+    """
+    camera = Camera("ortho", theta=theta, phi=phi, scale=scale)
+    vertices = glm.fit_unit_cube(mesh.vertices)
+    faces = mesh.faces
+    stats = None
+    if cull:
+        width, height = ax.figure.get_size_inches() * ax.figure.dpi
+        faces, stats = cull_faces(
+            vertices, faces, camera.transform, min_area=2 / (width * height)
+        )
+    if len(faces):
+        Mesh(
+            ax,
+            camera.transform,
+            vertices,
+            faces,
+            cmap=matplotlib.colormaps[colormap],
+            edgecolors=edgecolors,
+        )
+    return stats
+
+
+class Thumbnails(NamedTuple):
+    path: str
+    images: list
+    load_time: float
+    render_time: float
+
+
+def _render_file(path, name, views, size, output, scale, max_faces):
+    start = time.perf_counter()
+    mesh = load_mesh(path, max_faces=max_faces)
+    loaded = time.perf_counter()
+    prefix = os.path.join(output, name)
+    os.makedirs(os.path.dirname(prefix), exist_ok=True)
+    images = []
+    for theta, phi in views:
+        # Agg canvas, without pyplot: no GUI backend and no global state.
+        fig = Figure(figsize=(size / DPI, size / DPI), dpi=DPI)
+        FigureCanvasAgg(fig)
+        ax = fig.add_axes([0, 0, 1, 1], xlim=[-1, +1], ylim=[-1, +1], aspect=1)
+        ax.axis("off")
+        draw(ax, mesh, theta, phi, scale)
+        image = f"{prefix}-{theta:g}-{phi:g}.png"
+        fig.savefig(image)
+        images.append(image)
+    return Thumbnails(path, images, loaded - start, time.perf_counter() - loaded)
+
+
+def render_thumbnails(
+    paths,
+    views=VIEWS,
+    size=256,
+    workers=None,
+    output=OUTPUT,
+    scale=1.0,
+    max_faces=MAX_FACES,
+):
+    """Render PNG previews of STL and OBJ files from several `(theta, phi)` views.
+
+    Each file is loaded once and rendered in all views; files are spread
+    across a pool of `workers` processes. The images of a file are named
+    after it (with its extension), in the subdirectory of `output` that
+    mirrors its directory below the common directory of the files. Yields a
+    `Thumbnails` per file, in completion order.
+    """
+    files = {}
+    for path in paths:
+        files.setdefault(os.path.abspath(path), path)
+    if not files:
+        return
+    root = os.path.commonpath([os.path.dirname(path) for path in files])
+    paths = list(files.values())
+    names = [os.path.relpath(path, root) for path in files]
+    args = (views, size, output, scale, max_faces)
+    if workers == 1:
+        for path, name in zip(paths, names):
+            yield _render_file(path, name, *args)
+        return
+    with ProcessPoolExecutor(workers) as executor:
+        tasks = [
+            executor.submit(_render_file, path, name, *args)
+            for path, name in zip(paths, names)
+        ]
+        for task in as_completed(tasks):
+            yield task.result()
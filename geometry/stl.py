@@ -0,0 +1,485 @@
+"""STL file format: readers and writers."""
+
+import contextlib
+import io
+import itertools
+import math
+import mmap
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from .normals import compute_normals
+
+# Facets are formatted by blocks: one `%` operation per block, not per facet.
+BLOCK_SIZE = 65536
+
+# ASCII files are read by chunks of (at least) this many bytes.
+CHUNK_SIZE = 1 << 24
+
+WORKERS = os.cpu_count()
+
+FACET_TEMPLATE = (
+    "\tfacet normal %r %r %r\n"
+    "\t\touter loop\n"
+    "\t\tvertex %r %r %r\n"
+    "\t\tvertex %r %r %r\n"
+    "\t\tvertex %r %r %r\n"
+    "\t\tendloop\n"
+    "\tendfacet\n"
+)
+
+# Float formats of the ASCII writers, besides printf-style ones like "%.7e":
+# "repr" (of the float64 values), "shortest" (the shortest text that reads
+# back as the same float32 values), "fixed" and "scientific" (with a number
+# of decimals, PRECISION by default; the other formats take no precision).
+FLOAT_FORMATS = {"repr": "%r", "shortest": None, "fixed": "f", "scientific": "e"}
+PRECISION = {"fixed": 6, "scientific": 7}
+
+# Binary STL: 80-byte header, uint32 facet count, then one record per facet.
+HEADER_SIZE = 84
+RECORD = np.dtype(
+    [("normal", "<f4", (3,)), ("vertices", "<f4", (3, 3)), ("attr", "<u2")]
+)
+
+# Everything in a facet list that is not a number ("endfacet" before "facet").
+KEYWORDS = (b"endfacet", b"endloop", b"facet", b"normal", b"outer", b"loop", b"vertex")
+SOLID_LINE = re.compile(rb"(?:end)?solid[^\n]*")
+
+
+@contextlib.contextmanager
+def _open(file, mode, **kwargs):
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, mode, **kwargs) as f:
+            yield f
+    else:
+        yield file
+
+
+def _float_format(format="repr", precision=None):
+    """Return the printf-style format of floats, None for the shortest text."""
+    if format in PRECISION:
+        precision = PRECISION[format] if precision is None else precision
+        return f"%.{precision}{FLOAT_FORMATS[format]}"
+    if precision is not None:
+        raise ValueError(f"float format {format!r} takes no precision")
+    if format in FLOAT_FORMATS:
+        return FLOAT_FORMATS[format]
+    if "%" not in format:
+        raise ValueError(f"unknown float format {format!r}")
+    # Checked before anything is written.
+    try:
+        format % 1.0
+    except (TypeError, ValueError) as error:
+        raise ValueError(f"invalid float format {format!r}: {error}") from None
+    return format
+
+
+def _float_args(values, spec):
+    """Return the format and arguments of a block of floats, for `%`."""
+    if spec is None:
+        values = np.asarray(values, dtype=np.float32).astype(str)
+        return "%s", tuple(values.ravel().tolist())
+    return spec, tuple(np.asarray(values, dtype=np.float64).ravel().tolist())
+
+
+def _write_ascii_facets(f, triangles, normals=None, spec="%r"):
+    triangles = np.asarray(triangles, dtype=np.float32).reshape(-1, 3, 3)
+    n = len(triangles)
+    # `%r` on the float64 values gives the same text as `f"{value}"` on
+    # the original np.float32 values.
+    values = np.empty((min(n, BLOCK_SIZE), 12), dtype=np.float64)
+    for start in range(0, n, BLOCK_SIZE):
+        stop = min(start + BLOCK_SIZE, n)
+        block = values[: stop - start]
+        if normals is None:
+            block[:, :3] = compute_normals(triangles[start:stop])
+        else:
+            block[:, :3] = normals[start:stop]
+        block[:, 3:] = triangles[start:stop].reshape(-1, 9)
+        template, args = _float_args(block, spec)
+        f.write((FACET_TEMPLATE.replace("%r", template) * (stop - start)) % args)
+
+
+def write_ascii_stl(
+    file, triangles, normals=None, name="", format="repr", precision=None
+):
+    """Write triangles (and normals) to a path or text file as ASCII STL.
+
+    The floats are written with a format of `FLOAT_FORMATS` (and `precision`)
+    or a printf-style format.
+    """
+    spec = _float_format(format, precision)
+    with _open(file, "wt", encoding="utf-8", newline="\n") as f:
+        f.write(f"solid {name}\n")
+        _write_ascii_facets(f, triangles, normals, spec)
+        f.write(f"endsolid {name}")
+
+
+def make_stl(triangles, normals=None, name="", format="repr", precision=None):
+    """Return the ASCII STL description of a solid as a string."""
+    buffer = io.StringIO()
+    write_ascii_stl(buffer, triangles, normals, name, format, precision)
+    return buffer.getvalue()
+
+
+def _read_ascii_header(f):
+    line = f.readline()
+    if not line.lstrip().startswith(b"solid"):
+        raise ValueError("not an ASCII STL file (no 'solid' header)")
+    return line.strip()[5:].strip().decode("utf-8")
+
+
+def _chunks(f, chunk_size, size=None):
+    # Yield the chunks of a file, up to `size` bytes (to the end by default).
+    while size is None or size > 0:
+        chunk = f.read(chunk_size if size is None else min(chunk_size, size))
+        if not chunk:
+            return
+        if size is not None:
+            size -= len(chunk)
+        yield chunk
+
+
+def _count_facets(f, chunk_size, size=None):
+    count = 0
+    tail = b""
+    for chunk in _chunks(f, chunk_size, size):
+        window = tail + chunk
+        count += window.count(b"endfacet")
+        tail = window[-7:]
+    return count
+
+
+def _ascii_blocks(f, chunk_size, size=None):
+    # Yield `(k, 12)` float32 arrays (normal, then vertices) of whole facets.
+    carry = b""
+    for chunk in itertools.chain(_chunks(f, chunk_size, size), [b""]):
+        data = carry + chunk
+        end = len(data) if not chunk else data.rfind(b"endfacet") + 8
+        if end < 8:
+            carry = data
+            continue
+        data, carry = data[:end], data[end:]
+        count = data.count(b"endfacet")
+        text = SOLID_LINE.sub(b" ", data) if b"solid" in data else data
+        for keyword in KEYWORDS:
+            text = text.replace(keyword, b" ")
+        if count:
+            values = np.fromstring(text, dtype=np.float32, sep=" ")
+            if values.size != 12 * count:
+                raise ValueError("malformed ASCII STL facet")
+            yield values.reshape(count, 12)
+        elif text.strip():
+            raise ValueError("malformed ASCII STL facet")
+        if not chunk:
+            return
+
+
+def _facet_ranges(path, count):
+    """Split the facets of an ASCII STL path into `count` byte ranges.
+
+    Return the name of the solid and the ranges, which end after an
+    "endfacet" keyword (but the last one).
+    """
+    with open(path, "rb") as f:
+        name = _read_ascii_header(f)
+        start = f.tell()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            bounds = [start]
+            for i in range(1, count):
+                cut = start + i * (len(data) - start) // count
+                end = data.find(b"endfacet", max(cut, bounds[-1]))
+                if end < 0:
+                    break
+                bounds.append(end + 8)
+            bounds.append(len(data))
+    return name, list(itertools.pairwise(bounds))
+
+
+def _count_range(path, start, stop, chunk_size):
+    with open(path, "rb") as f:
+        f.seek(start)
+        return _count_facets(f, chunk_size, stop - start)
+
+
+def _parse_range(path, start, stop, chunk_size, memory, offset, count):
+    # Parse the facets of a byte range into rows of a shared (n, 12) array.
+    shm = shared_memory.SharedMemory(name=memory)
+    values = None
+    try:
+        values = np.ndarray((offset + count, 12), np.float32, buffer=shm.buf)
+        i = offset
+        with open(path, "rb") as f:
+            f.seek(start)
+            for block in _ascii_blocks(f, chunk_size, stop - start):
+                values[i : i + len(block)] = block
+                i += len(block)
+        if i != offset + count:
+            raise ValueError("malformed ASCII STL facet")
+    finally:
+        # The view must be released first, or close() raises BufferError
+        # (which would hide a parse error).
+        del values
+        shm.close()
+
+
+def _read_ascii_parallel(path, chunk_size, workers):
+    size = os.path.getsize(path)
+    name, ranges = _facet_ranges(path, min(workers, math.ceil(size / chunk_size)))
+    if len(ranges) == 1:
+        return read_ascii_stl(path, chunk_size)
+    starts, stops = zip(*ranges)
+    paths, chunk_sizes = [path] * len(ranges), [chunk_size] * len(ranges)
+    if os.name == "posix":
+        # The workers must share the resource tracker of this process, or
+        # theirs would unlink the shared memory when they exit.
+        resource_tracker.ensure_running()
+    with ProcessPoolExecutor(len(ranges)) as executor:
+        counts = list(executor.map(_count_range, paths, starts, stops, chunk_sizes))
+        n = sum(counts)
+        offsets = list(itertools.accumulate(counts, initial=0))[:-1]
+        shm = shared_memory.SharedMemory(create=True, size=max(48 * n, 1))
+        try:
+            tasks = executor.map(
+                _parse_range,
+                paths,
+                starts,
+                stops,
+                chunk_sizes,
+                [shm.name] * len(ranges),
+                offsets,
+                counts,
+            )
+            list(tasks)
+            values = np.ndarray((n, 12), np.float32, buffer=shm.buf)
+            # Copy out of the shared memory, which is released here.
+            normals = values[:, :3].copy()
+            triangles = values[:, 3:].reshape(n, 3, 3).copy()
+            del values
+        finally:
+            shm.close()
+            shm.unlink()
+    return triangles, normals, name
+
+
+def read_ascii_stl(file, chunk_size=CHUNK_SIZE, workers=1):
+    """Read an ASCII STL path or binary file; return `triangles, normals, name`.
+
+    With `workers > 1`, a path is split into ranges of whole facets (of at
+    least `chunk_size` bytes) which are parsed by a pool of processes.
+    """
+    if workers > 1 and isinstance(file, (str, os.PathLike)):
+        return _read_ascii_parallel(file, chunk_size, workers)
+    with _open(file, "rb") as f:
+        name = _read_ascii_header(f)
+        start = f.tell()
+        n = _count_facets(f, chunk_size)
+        f.seek(start)
+        triangles = np.empty((n, 3, 3), dtype=np.float32)
+        normals = np.empty((n, 3), dtype=np.float32)
+        i = 0
+        for block in _ascii_blocks(f, chunk_size):
+            j = i + len(block)
+            normals[i:j] = block[:, :3]
+            triangles[i:j] = block[:, 3:].reshape(-1, 3, 3)
+            i = j
+    return triangles, normals, name
+
+
+def _solid_ranges(path):
+    """Return the `(start, stop)` byte ranges of the solids of an ASCII STL path."""
+    ranges = []
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError("not an ASCII STL file (no 'solid' header)")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            start = data.find(b"solid")
+            while start >= 0:
+                end = data.find(b"endsolid", start)
+                if end < 0:
+                    ranges.append((start, len(data)))
+                    break
+                stop = data.find(b"\n", end)
+                stop = len(data) if stop < 0 else stop + 1
+                ranges.append((start, stop))
+                start = data.find(b"solid", stop)
+    return ranges
+
+
+def _read_solid(path, start, stop):
+    with open(path, "rb") as f:
+        f.seek(start)
+        return read_ascii_stl(io.BytesIO(f.read(stop - start)))
+
+
+def read_ascii_solids(path, workers=WORKERS):
+    """Read the solids of an ASCII STL path; return `{name: (triangles, normals)}`.
+
+    The solids are parsed by a pool of `workers` processes; the facets of the
+    solids with the same name are concatenated, in file order.
+    """
+    ranges = _solid_ranges(path)
+    if not ranges:
+        raise ValueError("not an ASCII STL file (no 'solid' header)")
+    starts, stops = zip(*ranges)
+    paths = [path] * len(ranges)
+    if workers > 1 and len(ranges) > 1:
+        chunksize = max(1, len(ranges) // (4 * workers))
+        with ProcessPoolExecutor(workers) as executor:
+            results = list(
+                executor.map(_read_solid, paths, starts, stops, chunksize=chunksize)
+            )
+    else:
+        results = list(map(_read_solid, paths, starts, stops))
+    solids = {}
+    for triangles, normals, name in results:
+        solids.setdefault(name, []).append((triangles, normals))
+    return {
+        name: tuple(np.concatenate(arrays) for arrays in zip(*parts))
+        for name, parts in solids.items()
+    }
+
+
+def _binary_count(f):
+    header = f.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE:
+        raise ValueError("not a binary STL file (truncated header)")
+    return int(np.frombuffer(header, dtype="<u4", count=1, offset=80)[0])
+
+
+def is_binary_stl(file):
+    """Tell whether a path holds a binary STL, based on its size."""
+    size = os.path.getsize(file)
+    if size < HEADER_SIZE:
+        return False
+    with open(file, "rb") as f:
+        n = _binary_count(f)
+    return size == HEADER_SIZE + n * RECORD.itemsize
+
+
+def read_binary_stl(file, mmap=True):
+    """Read a binary STL path; return `triangles, normals, attributes`.
+
+    With `mmap=True` the results are read-only views over the memory-mapped
+    file: nothing is read until it is accessed.
+    """
+    with open(file, "rb") as f:
+        n = _binary_count(f)
+        if os.fstat(f.fileno()).st_size < HEADER_SIZE + n * RECORD.itemsize:
+            raise ValueError("not a binary STL file (truncated facets)")
+        if mmap and n:
+            records = np.memmap(
+                f, dtype=RECORD, mode="r", offset=HEADER_SIZE, shape=(n,)
+            )
+        else:
+            records = np.fromfile(f, dtype=RECORD, count=n)
+    return records["vertices"], records["normal"], records["attr"]
+
+
+def _binary_records(triangles, normals=None, attributes=None):
+    triangles = np.asarray(triangles, dtype=np.float32).reshape(-1, 3, 3)
+    records = np.zeros(len(triangles), dtype=RECORD)
+    records["vertices"] = triangles
+    records["normal"] = compute_normals(triangles) if normals is None else normals
+    if attributes is not None:
+        records["attr"] = attributes
+    return records
+
+
+def _write_binary_header(f, n, header=b""):
+    if len(header) > 80:
+        raise ValueError("binary STL header is limited to 80 bytes")
+    f.write(header.ljust(80, b"\0"))
+    f.write(np.uint32(n).tobytes())
+
+
+def write_binary_stl(file, triangles, normals=None, attributes=None, header=b""):
+    """Write triangles (normals and attribute bytes) to a binary STL path."""
+    records = _binary_records(triangles, normals, attributes)
+    with _open(file, "wb") as f:
+        _write_binary_header(f, len(records), header)
+        f.write(memoryview(records))
+
+
+def binary_to_ascii_stl(file_in, file_out, name="", format="repr", precision=None):
+    """Convert a binary STL file to ASCII, one block of facets at a time."""
+    triangles, normals, _ = read_binary_stl(file_in)
+    write_ascii_stl(file_out, triangles, normals, name, format, precision)
+
+
+def ascii_to_binary_stl(file_in, file_out, header=b"", chunk_size=CHUNK_SIZE):
+    """Convert an ASCII STL file to binary, one chunk of text at a time."""
+    with _open(file_in, "rb") as f, _open(file_out, "wb") as out:
+        _read_ascii_header(f)
+        start = f.tell()
+        n = _count_facets(f, chunk_size)
+        f.seek(start)
+        _write_binary_header(out, n, header)
+        for block in _ascii_blocks(f, chunk_size):
+            out.write(memoryview(_binary_records(block[:, 3:], block[:, :3])))
+
+
+def read_stl(file):
+    """Read an ASCII or binary STL path; return `triangles, normals`."""
+    if is_binary_stl(file):
+        triangles, normals, _ = read_binary_stl(file)
+    else:
+        triangles, normals, _ = read_ascii_stl(file)
+    return triangles, normals
+
+
+class StlWriter:
+    """Write facets to an STL file block by block.
+
+    The facet count of a binary file is written when the writer is closed;
+    the floats of an ASCII file are written as in `write_ascii_stl`.
+    """
+
+    def __init__(
+        self, file, binary=True, name="", header=b"", format="repr", precision=None
+    ):
+        self.binary = binary
+        self.name = name
+        self.count = 0
+        self._spec = _float_format(format, precision)
+        self._stack = contextlib.ExitStack()
+        if binary:
+            self._file = self._stack.enter_context(_open(file, "wb"))
+            self._start = self._file.tell()
+            _write_binary_header(self._file, 0, header)
+        else:
+            mode = {"encoding": "utf-8", "newline": "\n"}
+            self._file = self._stack.enter_context(_open(file, "wt", **mode))
+            self._file.write(f"solid {name}\n")
+
+    def write(self, triangles, normals=None, attributes=None):
+        triangles = np.asarray(triangles, dtype=np.float32).reshape(-1, 3, 3)
+        if self.binary:
+            records = _binary_records(triangles, normals, attributes)
+            self._file.write(memoryview(records))
+        else:
+            _write_ascii_facets(self._file, triangles, normals, self._spec)
+        self.count += len(triangles)
+
+    def close(self):
+        if self._file is None:
+            return
+        if self.binary:
+            end = self._file.tell()
+            self._file.seek(self._start + 80)
+            self._file.write(np.uint32(self.count).tobytes())
+            self._file.seek(end)
+        else:
+            self._file.write(f"endsolid {self.name}")
+        self._file = None
+        self._stack.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,245 @@
+"""Streaming of facets: bounded blocks from STL and OBJ files, and stages.
+
+`iter_facets` yields `(triangles, normals)` blocks of at most `block` facets.
+Stages consume such blocks and yield new ones, so that a pipeline like
+
+    check = Diagnosis()
+    write(diagnose(transform(iter_facets(path), 25.4 * np.eye(3)), check), out)
+    print(check.report())
+
+converts, validates and rescales a mesh of any size in constant memory (but
+for the OBJ vertices and the edges of the shared edge rule).
+"""
+
+import os
+
+import numpy as np
+
+from . import stl
+from .diagnostics import TOLERANCE, Report, RuleReport, _orientation, _positive_octant
+from .normals import compute_normals
+from .obj import _faces, _floats, _positions, triangulate
+
+BLOCK_SIZE = stl.BLOCK_SIZE
+
+# Bytes of text read per facet of a block (an ASCII STL facet takes about
+# 250 bytes, an OBJ face and its vertices less).
+TEXT_SIZE = 256
+
+
+def _reblock(blocks, block):
+    """Cut or merge `(triangles, normals)` blocks into blocks of `block` facets."""
+    pending, count = [], 0
+    for triangles, normals in blocks:
+        pending.append((triangles, normals))
+        count += len(triangles)
+        if count < block:
+            continue
+        triangles = np.concatenate([t for t, _ in pending])
+        normals = np.concatenate([n for _, n in pending])
+        stop = count - count % block
+        for start in range(0, stop, block):
+            yield triangles[start : start + block], normals[start : start + block]
+        pending, count = [(triangles[stop:], normals[stop:])], count - stop
+    if count:
+        yield (
+            np.concatenate([t for t, _ in pending]),
+            np.concatenate([n for _, n in pending]),
+        )
+
+
+def _ascii_facets(path, block):
+    with open(path, "rb") as f:
+        stl._read_ascii_header(f)
+        for values in stl._ascii_blocks(f, TEXT_SIZE * block):
+            yield values[:, 3:].reshape(-1, 3, 3), values[:, :3]
+
+
+def _binary_facets(path, block):
+    with open(path, "rb") as f:
+        n = stl._binary_count(f)
+        for start in range(0, n, block):
+            records = np.fromfile(f, dtype=stl.RECORD, count=min(block, n - start))
+            if len(records) < min(block, n - start):
+                raise ValueError("not a binary STL file (truncated facets)")
+            yield records["vertices"], records["normal"]
+
+
+def _obj_chunks(f, chunk_size):
+    # Yield chunks of whole lines, with a newline prepended (see obj.STATEMENTS).
+    carry = b""
+    while chunk := f.read(chunk_size):
+        data = carry + chunk
+        end = data.rfind(b"\n") + 1
+        data, carry = data[:end], data[end:]
+        yield b"\n" + data
+    if carry:
+        yield b"\n" + carry + b"\n"
+
+
+def _obj_facets(path, block):
+    # Faces may only refer to the vertices above them, as in `read_obj`.
+    vertices = np.empty((block, 3), dtype=np.float32)
+    count = 0
+    with open(path, "rb") as f:
+        for data in _obj_chunks(f, TEXT_SIZE * block):
+            chunk = _floats(data, b"v", 3)
+            if count + len(chunk) > len(vertices):
+                size = max(2 * len(vertices), count + len(chunk))
+                vertices = np.concatenate(
+                    [vertices[:count], np.empty((size - count, 3), dtype=np.float32)]
+                )
+            vertices[count : count + len(chunk)] = chunk
+            corners, sizes, _ = _faces(data)
+            if len(sizes) == 0:
+                count += len(chunk)
+                continue
+            index = corners[:, 0]
+            if np.any(index < 0):
+                lines = np.repeat(_positions(data, b"f"), sizes)
+                before = count + np.searchsorted(_positions(data, b"v"), lines)
+                index = np.where(index < 0, before + index, index - 1)
+            else:
+                index = index - 1
+            count += len(chunk)
+            if np.any(index < 0) or np.any(index >= count):
+                raise ValueError("'v' index out of range in 'f' line")
+            triangles = vertices[triangulate(index, sizes)]
+            yield triangles, compute_normals(triangles)
+
+
+def iter_facets(path, block=BLOCK_SIZE):
+    """Yield the `(triangles, normals)` of an STL or OBJ file by blocks.
+
+    Blocks have `block` facets (but the last one). OBJ files are detected by
+    their extension; their faces are triangulated and their normals computed
+    with the right-hand rule.
+    """
+    if os.fspath(path).lower().endswith(".obj"):
+        blocks = _obj_facets(path, block)
+    elif stl.is_binary_stl(path):
+        blocks = _binary_facets(path, block)
+    else:
+        blocks = _ascii_facets(path, block)
+    return _reblock(blocks, block)
+
+
+def transform(blocks, matrix=None, offset=None):
+    """Map the points `p` of the facets to `matrix @ p + offset`.
+
+    Normals follow the inverse transpose of `matrix`; when it reverses the
+    orientation, the last two vertices of the facets are swapped, so that
+    they still follow the right-hand rule.
+    """
+    matrix = np.eye(3) if matrix is None else np.asarray(matrix, dtype=np.float64)
+    offset = np.zeros(3) if offset is None else np.asarray(offset, dtype=np.float64)
+    inverse = np.linalg.inv(matrix)
+    reverse = np.linalg.det(matrix) < 0
+    for triangles, normals in blocks:
+        triangles = (triangles @ matrix.T + offset).astype(np.float32)
+        normals = normals @ inverse
+        lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+        np.divide(normals, lengths, out=normals, where=lengths > 0)
+        if reverse:
+            triangles = triangles[:, [0, 2, 1]]
+        yield triangles, normals.astype(np.float32)
+
+
+def select(blocks, predicate):
+    """Keep the facets for which `predicate(triangles, normals)` is True."""
+    for triangles, normals in blocks:
+        mask = predicate(triangles, normals)
+        yield triangles[mask], normals[mask]
+
+
+def recompute_normals(blocks):
+    """Replace the normals by the right-hand rule normals."""
+    for triangles, _ in blocks:
+        yield triangles, compute_normals(triangles)
+
+
+def _edge_keys(triangles):
+    # 64-bit hashes of the (unordered) vertex pairs of the facet edges, from
+    # the bit patterns of the coordinates (once -0.0 is replaced by 0.0).
+    bits = (triangles + np.float32(0.0)).view(np.uint32).astype(np.uint64)
+    primes = np.array([0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9])
+    vertices = np.bitwise_xor.reduce(bits * primes.astype(np.uint64), axis=2)
+    vertices ^= vertices >> np.uint64(29)
+    a, b = vertices, np.roll(vertices, -1, axis=1)
+    lo, hi = np.minimum(a, b), np.maximum(a, b)
+    keys = lo * np.uint64(0xBF58476D1CE4E5B9) + hi
+    return keys ^ (keys >> np.uint64(31))
+
+
+class Diagnosis:
+    """Rule checks of a stream of facets, reported once it is consumed.
+
+    The positive octant, orientation and ascending rules run in constant
+    memory. The shared edge rule keeps a 64-bit hash of every edge (24 bytes
+    per facet) until the report; with `shared_edge=False` it is skipped and
+    reported as `None`.
+    """
+
+    def __init__(self, tolerance=TOLERANCE, shared_edge=True):
+        self.tolerance = tolerance
+        self.shared_edge = shared_edge
+        self.count = 0
+        self._indices = {rule: [] for rule in Report._fields}
+        self._z = None
+        self._edges = []
+
+    def update(self, triangles, normals):
+        triangles = np.asarray(triangles, dtype=np.float32).reshape(-1, 3, 3)
+        if len(triangles) == 0:
+            return
+        z = triangles[:, :, 2].mean(axis=1)
+        masks = {
+            "positive_octant": _positive_octant(triangles),
+            "orientation": _orientation(triangles, normals, self.tolerance),
+            "ascending": np.diff(z, prepend=z[0] if self._z is None else self._z) < 0,
+        }
+        for rule, mask in masks.items():
+            self._indices[rule].append(np.flatnonzero(mask) + self.count)
+        if self.shared_edge:
+            self._edges.append(_edge_keys(triangles))
+        self._z = z[-1]
+        self.count += len(triangles)
+
+    def report(self):
+        """Return the `Report` of the facets seen so far."""
+        indices = {
+            rule: np.concatenate(arrays) if arrays else np.empty(0, dtype=np.int64)
+            for rule, arrays in self._indices.items()
+        }
+        if self._edges:
+            keys = np.concatenate(self._edges).ravel()
+            _, inverse, counts = np.unique(
+                keys, return_inverse=True, return_counts=True
+            )
+            indices["shared_edge"] = np.flatnonzero(
+                np.any((counts[inverse] != 2).reshape(-1, 3), axis=1)
+            )
+        count = max(self.count, 1)
+        return Report(
+            *(
+                RuleReport(rule.replace("_", " "), 100.0 * len(ids) / count, ids)
+                if self.shared_edge or rule != "shared_edge"
+                else None
+                for rule, ids in indices.items()
+            )
+        )
+
+
+def diagnose(blocks, diagnosis):
+    """Check the rules on the facets with a `Diagnosis`, passing them on."""
+    for triangles, normals in blocks:
+        diagnosis.update(triangles, normals)
+        yield triangles, normals
+
+
+def write(blocks, file, binary=True, name="", header=b""):
+    """Write the facets to an STL file; return their number."""
+    with stl.StlWriter(file, binary=binary, name=name, header=header) as writer:
+        for triangles, normals in blocks:
+            writer.write(triangles, normals)
+    return writer.count
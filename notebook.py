@@ -176,42 +176,18 @@ def __(np):
 
 
 @app.cell
-def __(np):
+def __(geometry):
     def make_normals(triangles):
-        (n, m, p) = triangles.shape
-        normals = np.zeros((n, 3), dtype= np.float32)
-        for i in range(n):
-            normals[i, 0] = np.cross(triangles[i, 1] - triangles[i, 0],triangles[i, 2] - triangles[i, 0])[0]
-            normals[i, 1] = np.cross(triangles[i, 1] - triangles[i, 0],triangles[i, 2] - triangles[i, 0])[1]
-            normals[i, 2] = np.cross(triangles[i, 1] - triangles[i, 0],triangles[i, 2] - triangles[i, 0])[2]
-        return normals
+        return geometry.normals.compute_normals(triangles)
     return (make_normals,)
 
 
 @app.cell
-def __():
-    def make_facets(triangle, normal):
-        facet = f'\tfacet normal {normal[0]} {normal[1]} {normal[2]}\n'
-        facet += '\t\touter loop\n'
-        for j in range(3):
-            facet += f'\t\tvertex {triangle[j, 0]} {triangle[j, 1]} {triangle[j, 2]}\n'
-        facet += '\t\tendloop\n'
-        facet += '\tendfacet\n'
-        return facet
-    return (make_facets,)
-
-
-@app.cell
-def __(make_facets, make_normals):
+def __(geometry, make_normals):
     def make_stl(triangles, normals = None, name = ''):
-        n, m, p = triangles.shape 
-        stl_ascii = f'solid {name}\n'
         if normals is None:
             normals = make_normals(triangles)
-        for i in range(n):
-            stl_ascii += make_facets(triangles[i], normals[i])
-        stl_ascii += f'endsolid {name}'
-        return stl_ascii
+        return geometry.stl.make_stl(triangles, normals, name)
     return (make_stl,)
 
 
@@ -262,16 +238,21 @@ def __(mo):
 
 
 @app.cell
-def __(np, stl):
-    def tokenize(object):
-        stl = stl.replace('\t', '').replace('\n', ' ')
-        stl = stl.split()
-        indices = [i for i, value in enumerate(stl) if (value == 'normal') or (value == 'vertex')]
-        for i in indices:
-            for k in range(3):
-                stl[i + k + 1] = np.float32(stl[i + k + 1])
-        return stl
-    return (tokenize,)
+def __(geometry, io, np):
+    # The tokens of a facet; the numbers (normal, then vertices) are None.
+    FACET = ["facet", "normal", None, None, None, "outer", "loop"]
+    FACET += 3 * ["vertex", None, None, None] + ["endloop", "endfacet"]
+    NUMBERS = [i for i, token in enumerate(FACET) if token is None]
+
+    def tokenize(stl):
+        triangles, normals, name = geometry.stl.read_ascii_stl(io.BytesIO(stl.encode()))
+        numbers = np.concatenate([normals, triangles.reshape(-1, 9)], axis=1)
+        facets = np.empty((len(numbers), len(FACET)), dtype=object)
+        facets[:] = FACET
+        # Iterating a float32 array yields np.float32 numbers.
+        facets[:, NUMBERS] = np.array(list(numbers.ravel()), dtype=object).reshape(-1, 12)
+        return ["solid", *name.split(), *facets.ravel().tolist(), "endsolid", *name.split()]
+    return FACET, NUMBERS, tokenize
 
 
 @app.cell
@@ -338,22 +319,19 @@ def __(mo):
 
 
 @app.cell
-def __(np):
+def __(FACET, NUMBERS, np):
     def parse(tokens):
-        name = ''
-        if tokens[1] == tokens[-1]:
-            name = tokens[-1]
-        ind_norm = [i for i, value in enumerate(tokens) if value == 'normal']
-        ind_vertex = [i for i, value in enumerate(tokens) if value == 'vertex']
-
-        n = tokens.count('facet')
-        triangles = np.zeros((n,3,3), dtype=np.float32)
-        normals = np.zeros((n,3), dtype = np.float32)
-        for i in ind_norm:
-            normals[ind_norm.index(i)] = np.array(tokens[i+1:i+4])
-        for i in ind_vertex[::3]:
-            triangles[ind_vertex[::3].index(i)] = np.array([tokens[i+1:i+4], tokens[i+5:i+8], tokens[i+9:i+12]])
-        return triangles, normals, name
+        # Only the name tokens are searched: comparing the numbers to strings
+        # is slow.
+        start = 1
+        while tokens[start] not in ("facet", "endsolid"):
+            start += 1
+        end = len(tokens) - 1 - tokens[::-1].index("endsolid")
+        name = " ".join(tokens[1:start])
+        n = (end - start) // len(FACET)
+        facets = np.array(tokens[start : start + n * len(FACET)], dtype=object)
+        numbers = facets.reshape(n, len(FACET))[:, NUMBERS].astype(np.float32)
+        return numbers[:, 3:].reshape(n, 3, 3), numbers[:, :3], name
     return (parse,)
 
 
@@ -392,92 +370,40 @@ def __(mo):
 
 
 @app.cell
-def __():
-    def check_positive_octant(triangles, n):
-        count = 0
-        for i in range(n):
-            for j in range(3):
-                for k in range(3):
-                    if triangles[i, j, k]<0:
-                        count += 1
-        return (count/(3*n))*100
+def __(geometry):
+    def check_positive_octant(triangles):
+        return geometry.diagnostics.positive_octant(triangles).percentage
     return (check_positive_octant,)
 
 
 @app.cell
-def __(np):
-    def check_orientation(triangles, normals, n):
-        count = 0
-        for i in range(n):
-            if abs(np.norm(normals([i])) - 1) > 0.1:
-                count += 1
-                continue
-            if np.dot(np.cross(triangles[i,1] - triangles[i,0], triangles[i,2] - triangles[i,0]), normals[i]) != np.norm(np.cross(triangles[i,1] - triangles[i,0], triangles[i,2] - triangles[i,0]))*np.norm(normals[i]):
-                count += 1
-        return 100*count/n
+def __(geometry):
+    def check_orientation(triangles, normals):
+        return geometry.diagnostics.orientation(triangles, normals).percentage
     return (check_orientation,)
 
 
 @app.cell
-def __():
-    def triangle_to_edges(triangle):
-    	v0, v1, v2 = map(tuple, triangle)
-    	return [tuple(v0, v1), tuple(v1, v2),tuple(v2, v0)]
-    return (triangle_to_edges,)
-
-
-@app.cell
-def __(shared_twice, triangle_edges, triangle_to_edges):
-    def check_shared_edge(triangles,n):
-        edge_count = {}
-        for i in range(n):
-            triangled_edges = triangle_to_edges(triangles[i])
-            for edge in triangle_edges:
-                if edge in edge_count:
-                    edge_count[edge] +=1
-        shared_txice = sum(1 for count in edge_count.values() if count == 2)
-        total_edges = len(edge_count)
-        return (shared_twice/total_edges)*100
+def __(geometry):
+    def check_shared_edge(triangles):
+        return geometry.diagnostics.shared_edge(triangles).percentage
     return (check_shared_edge,)
 
 
 @app.cell
-def __():
-    def barycenter_z(triangle):
-        v0, v1, v2 = triangle
-        return (1/3)*(v0[2]+v1[2]+v2[2])
-    return (barycenter_z,)
-
-
-@app.cell
-def __(barycenter_z):
-    def check_barycenter_ascending(triangles,n):
-        count=0
-        for i in range(n):
-            if barycenter_z(triangles[i])>barycenter_z(triangles[i+1]):
-                count += 1
-        return 100*count/n
+def __(geometry):
+    def check_barycenter_ascending(triangles):
+        return geometry.diagnostics.ascending(triangles).percentage
     return (check_barycenter_ascending,)
 
 
 @app.cell
-def __(
-    check_barycenter_ascending,
-    check_orientation,
-    check_positive_octant,
-    check_shared_edge,
-    parse,
-    tirangles,
-    tokenize,
-):
+def __(geometry, io):
     def diagnostic(stl):
-        triangles, normals, name = parse(tokenize(stl))
-        n=triangles.shape[0]
-        positive_percentage = check_positive_octant(triangles, n)
-        orientation_percentage = check_orientation(triangles,normals,n)
-        shared_edge_percentage = check_shared_edge(tirangles,n)
-        ascending_rule_percentage = check_barycenter_ascending(triangles,n)
-        print(f'here are the percentage of validity for the following rules for the {name} stl file:\n positive octant rule % = {positive_percentage}\n orientation rule % = {orientation_percentage}\n shared edges rule % = {shared_edge_percentage}\n ascending rule % = {ascending_rule_percentage}')
+        triangles, normals, name = geometry.stl.read_ascii_stl(io.BytesIO(stl.encode()))
+        report = geometry.diagnostics.diagnose(triangles, normals)
+        print(f'here are the percentages of facets violating the rules for the {name} stl file:\n{report}')
+        return report
     return (diagnostic,)
 
 
@@ -531,23 +457,11 @@ def __(mo):
 
 
 @app.cell
-def __(make_stl, np, triangle):
+def __(geometry, io):
     def OBJ_to_STL(obj):
-        list=obj.split('\n')
-        list = list[3:]
-        list = ' '.join(list)
-        list = list.split('f')
-        facets = list[1:]
-        vertices = list[0].split('v')
-        triangles=[]
-        for facet in facets:
-            facet=facet.split()
-            triangle = [vertices[int(triangle[0])], vertices[int(triangle[1])], vertices[int(triangle[2])]]
-            triangle_final = []
-            for vertex in triangle:
-            	triangle_final.append(vertex.split())
-            triangles.append(triangle_final)
-        return make_stl(np.array(triangles, dtype=np.float32))
+        stl_ascii = io.StringIO()
+        geometry.obj.obj_to_stl(io.BytesIO(obj.encode()), stl_ascii)
+        return stl_ascii.getvalue()
     return (OBJ_to_STL,)
 
 
@@ -582,20 +496,9 @@ def __(mo, show):
 
 
 @app.cell
-def __(make_STL, np):
+def __(geometry):
     def STL_binary_to_text(stl_filename_in, stl_filename_out):
-        with open(stl_filename_in, mode="rb") as file:
-            _ = file.read(80)
-            n = np.fromfile(file, dtype=np.uint32, count=1)[0]
-            normals = []
-            faces = []
-            for i in range(n):
-                normals.append(np.fromfile(file, dtype=np.float32, count=3))
-                faces.append(np.fromfile(file, dtype=np.float32, count=9).reshape(3, 3))
-                _ = file.read(2)
-        stl_text = make_STL(faces, normals)
-        with open(stl_filename_out, mode="w", encoding="utf-8") as file:
-            file.write(stl_text)
+        geometry.stl.binary_to_ascii_stl(stl_filename_in, stl_filename_out)
     return (STL_binary_to_text,)
 
 
@@ -609,11 +512,13 @@ def __(mo):
 
 
 @app.cell
-def __(X, Y, Z, box, cylinder, mo, show, sphere):
+def __(X, Y, Z, box, cylinder, geometry, mo, show, sphere):
     demo_csg = sphere(1) & box(1.5)
     _c = cylinder(0.5)
     demo_csg = demo_csg - (_c.orient(X) | _c.orient(Y) | _c.orient(Z))
-    demo_csg.save('output/demo-csg.stl', step=0.05)
+    geometry.csg.mesh_sdf(
+        demo_csg, "output/demo-csg.stl", step=0.05, workers=4, batch_size=32
+    )
     mo.show_code(show("output/demo-csg.stl", theta=45.0, phi=45.0, scale=1.0))
     return (demo_csg,)
 
@@ -629,6 +534,7 @@ def __(
     box,
     cylinder,
     difference,
+    geometry,
     intersection,
     mo,
     orient,
@@ -647,11 +553,43 @@ def __(
             orient(cylinder(0.5), [0.0, 0.0, 1.0]),
         ),
     )
-    demo_csg_alt.save("output/demo-csg-alt.stl", step=0.05)
+    geometry.csg.mesh_sdf(
+        demo_csg_alt, "output/demo-csg-alt.stl", step=0.05, workers=4, batch_size=32
+    )
     mo.show_code(show("output/demo-csg-alt.stl", theta=45.0, phi=45.0, scale=1.0))
     return (demo_csg_alt,)
 
 
+@app.cell
+def __(mo):
+    mo.md(
+        """ℹ️ **Remark.** The `geometry.expression` module provides the same functions as `sdf`, but structurally identical subtrees are evaluated once per batch of points, and the shapes whose bounding box is far enough from a batch are skipped altogether:"""
+    )
+    return
+
+
+@app.cell
+def __(geometry, mo, show):
+    _e = geometry.expression
+    demo_csg_expr = _e.difference(
+        _e.intersection(
+            _e.sphere(1),
+            _e.box(1.5),
+        ),
+        _e.union(
+            _e.orient(_e.cylinder(0.5), [1.0, 0.0, 0.0]),
+            _e.orient(_e.cylinder(0.5), [0.0, 1.0, 0.0]),
+            _e.orient(_e.cylinder(0.5), [0.0, 0.0, 1.0]),
+        ),
+    )
+    geometry.csg.mesh_sdf(
+        demo_csg_expr, "output/demo-csg-expr.stl", step=0.05, batch_size=8
+    )
+    print(demo_csg_expr.stats)
+    mo.show_code(show("output/demo-csg-expr.stl", theta=45.0, phi=45.0, scale=1.0))
+    return (demo_csg_expr,)
+
+
 @app.cell
 def __(mo):
     mo.md(
@@ -674,6 +612,16 @@ def __(mo):
     return
 
 
+@app.cell
+def __(geometry, mo, show):
+    def jcad_to_stl(jcad_filename, stl_filename, step=0.02):
+        return geometry.jcad.jcad_to_stl(jcad_filename, stl_filename, step=step)
+
+    print(jcad_to_stl("data/demo_jcad.jcad", "output/demo-jcad.stl", step=0.05))
+    mo.show_code(show("output/demo-jcad.stl", theta=45.0, phi=45.0, scale=1.0))
+    return (jcad_to_stl,)
+
+
 @app.cell
 def __(mo):
     mo.md("""## Appendix""")
@@ -689,6 +637,7 @@ def __(mo):
 @app.cell
 def __():
     # Python Standard Library
+    import io
     import json
 
     # Marimo
@@ -698,33 +647,35 @@ def __():
     import numpy as np
     import matplotlib.pyplot as plt
     import mpl3d
-    from mpl3d import glm
-    from mpl3d.mesh import Mesh
-    from mpl3d.camera import Camera
-
-    import meshio
-
-    np.seterr(over="ignore")  # 🩹 deal with a meshio false warning
 
     import sdf
     from sdf import sphere, box, cylinder
     from sdf import X, Y, Z
     from sdf import intersection, union, orient, difference
 
+    # Local Package
+    import geometry.cache
+    import geometry.csg
+    import geometry.diagnostics
+    import geometry.expression
+    import geometry.jcad
+    import geometry.normals
+    import geometry.obj
+    import geometry.render
+    import geometry.stl
+
     mo.show_code()
     return (
-        Camera,
-        Mesh,
         X,
         Y,
         Z,
         box,
         cylinder,
         difference,
-        glm,
+        geometry,
         intersection,
+        io,
         json,
-        meshio,
         mo,
         mpl3d,
         np,
@@ -738,12 +689,19 @@ def __():
 
 @app.cell
 def __(mo):
-    mo.md(r"""### STL Viewer""")
+    mo.md(
+        r"""
+        ### STL Viewer
+
+        With `cull=True`, `show` skips the faces outside of the view, smaller than half a pixel or facing away from the camera.
+        Culling is off by default: it assumes outward, counter-clockwise facets, so that facets with the wrong orientation (like the 7 that the orientation rule flags in the teapot) and the interior of open meshes vanish, and it changes the range of the depth colormap.
+        """
+    )
     return
 
 
 @app.cell
-def __(Camera, Mesh, glm, meshio, mo, plt):
+def __(geometry, mo, plt):
     def show(
         filename,
         theta=0.0,
@@ -752,23 +710,19 @@ def __(Camera, Mesh, glm, meshio, mo, plt):
         colormap="viridis",
         edgecolors=(0, 0, 0, 0.25),
         figsize=(6, 6),
+        max_faces=20_000,
+        cull=False,
+        verbose=False,
     ):
         fig = plt.figure(figsize=figsize)
         ax = fig.add_axes([0, 0, 1, 1], xlim=[-1, +1], ylim=[-1, +1], aspect=1)
         ax.axis("off")
-        camera = Camera("ortho", theta=theta, phi=phi, scale=scale)
-        mesh = meshio.read(filename)
-        vertices = glm.fit_unit_cube(mesh.points)
-        faces = mesh.cells[0].data
-        vertices = glm.fit_unit_cube(vertices)
-        mesh = Mesh(
-            ax,
-            camera.transform,
-            vertices,
-            faces,
-            cmap=plt.get_cmap(colormap),
-            edgecolors=edgecolors,
+        mesh = geometry.cache.load_mesh(filename, max_faces=max_faces)
+        stats = geometry.render.draw(
+            ax, mesh, theta, phi, scale, colormap, edgecolors, cull
         )
+        if verbose and stats is not None:
+            print(stats)
         return mo.center(fig)
 
     mo.show_code()
@@ -0,0 +1,57 @@
+import argparse
+import glob
+import os
+
+from geometry.render import MAX_FACES, OUTPUT, VIEWS, render_thumbnails
+
+EXTENSIONS = (".stl", ".obj")
+
+
+def view(text):
+    theta, phi = text.split(",")
+    return float(theta), float(phi)
+
+
+def mesh_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(glob.glob(os.path.join(path, "*"))):
+                if name.lower().endswith(EXTENSIONS):
+                    yield name
+        else:
+            yield path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Render previews of STL and OBJ files."
+    )
+    parser.add_argument("paths", nargs="+", help="mesh files or directories")
+    parser.add_argument(
+        "--view",
+        type=view,
+        action="append",
+        metavar="THETA,PHI",
+        help="camera angles, in degrees (repeatable)",
+    )
+    parser.add_argument("--size", type=int, default=256, help="image size, in pixels")
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--max-faces", type=int, default=MAX_FACES)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", default=OUTPUT)
+    args = parser.parse_args()
+
+    results = render_thumbnails(
+        list(mesh_files(args.paths)),
+        views=args.view or VIEWS,
+        size=args.size,
+        workers=args.workers,
+        output=args.output,
+        scale=args.scale,
+        max_faces=args.max_faces,
+    )
+    for result in results:
+        print(
+            f"{result.path}: {len(result.images)} images, "
+            f"load {result.load_time:.3f} s, render {result.render_time:.3f} s"
+        )
@@ -1,9 +1,122 @@
+import argparse
+import math
+import os
 import sys
+import time
+
+import matplotlib.image
+import numpy as np
 import pygfx as gfx
+import wgpu
+from wgpu.gui.offscreen import WgpuCanvas
+
+
+def merge(meshes):
+    """Merge meshes into a single mesh, with one position and one index buffer."""
+    positions, indices = [], []
+    offset = 0
+    for mesh in meshes:
+        matrix = mesh.world.matrix
+        points = mesh.geometry.positions.data.astype(np.float32)
+        points = points @ matrix[:3, :3].T + matrix[:3, 3]
+        positions.append(points)
+        indices.append(mesh.geometry.indices.data.reshape(-1, 3) + offset)
+        offset += len(points)
+    geometry = gfx.Geometry(
+        positions=np.concatenate(positions).astype(np.float32),
+        indices=np.concatenate(indices).astype(np.uint32),
+    )
+    return gfx.Mesh(geometry, gfx.MeshPhongMaterial())
+
+
+def render_orbit(mesh, frames, size, output=None):
+    """Render an orbit around the mesh off-screen.
+
+    Return the timing of a first draw, which uploads the buffers and compiles
+    the shaders, and the timings of the orbit frames.
+    """
+    canvas = WgpuCanvas(size=size)
+    renderer = gfx.renderers.WgpuRenderer(canvas)
+    scene = gfx.Scene()
+    scene.add(mesh, gfx.AmbientLight())
+    camera = gfx.PerspectiveCamera(50, size[0] / size[1])
+    camera.add(gfx.DirectionalLight())
+    scene.add(camera)
+    canvas.request_draw(lambda: renderer.render(scene, camera))
+
+    sphere = mesh.get_world_bounding_sphere()
+    center, distance = sphere[:3], 2.5 * sphere[3]
+
+    def draw(angle):
+        camera.local.position = center + distance * np.array(
+            [math.cos(angle), math.sin(angle), 0.5]
+        )
+        camera.show_pos(center, up=(0, 0, 1))
+        start = time.perf_counter()
+        image = np.asarray(canvas.draw())
+        return image, time.perf_counter() - start
+
+    _, first = draw(0.0)
+    timings = []
+    for frame in range(frames):
+        image, timing = draw(2 * math.pi * frame / frames)
+        timings.append(timing)
+        if output is not None:
+            path = os.path.join(output, f"frame-{frame:04d}.png")
+            matplotlib.image.imsave(path, image)
+    return first, timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="View STL and OBJ files.")
+    parser.add_argument("filename", nargs="?", help="STL or OBJ file")
+    parser.add_argument(
+        "--offscreen",
+        action="store_true",
+        help="render a camera orbit off-screen and print the frame timings",
+    )
+    parser.add_argument("--frames", type=int, default=36)
+    parser.add_argument("--size", type=int, nargs=2, default=(640, 480))
+    parser.add_argument("--output", help="directory of the PNG frames")
+    parser.add_argument(
+        "--software",
+        action="store_true",
+        help="use the fallback (CPU) adapter, no GPU needed",
+    )
+    args = parser.parse_args()
+    if args.filename is None:
+        sys.exit("missing STL or OBJ file")
+
+    if args.software:
+        adapter = wgpu.gpu.request_adapter(force_fallback_adapter=True)
+        gfx.renderers.wgpu.select_adapter(adapter)
+        # pygfx requires this feature for volume textures only; CPU adapters
+        # (e.g. llvmpipe) lack it. The required features are the private
+        # `Shared._features` set of pygfx 0.5.
+        features = getattr(gfx.renderers.wgpu.engine.shared.Shared, "_features", None)
+        if not isinstance(features, set):
+            sys.exit(f"--software is not supported with pygfx {gfx.__version__}")
+        features.discard("float32-filterable")
 
-if len(sys.argv) == 1:
-    sys.exit("missing STL or OBJ file") 
+    start = time.perf_counter()
+    meshes = gfx.load_mesh(args.filename)
+    loaded = time.perf_counter()
+    mesh = merge(meshes)
+    merged = time.perf_counter()
 
-meshes = gfx.load_mesh(sys.argv[1])
-display = gfx.Display()
-display.show(meshes[0], up=(0, 0, 1))
+    if not args.offscreen:
+        display = gfx.Display()
+        display.show(mesh, up=(0, 0, 1))
+    else:
+        if args.output is not None:
+            os.makedirs(args.output, exist_ok=True)
+        print(
+            f"{len(meshes)} meshes, {len(mesh.geometry.indices.data)} faces: "
+            f"load {loaded - start:.3f} s, merge {merged - loaded:.3f} s"
+        )
+        first, timings = render_orbit(mesh, args.frames, tuple(args.size), args.output)
+        print(f"first draw (upload and shader compilation): {1000 * first:.1f} ms")
+        for frame, timing in enumerate(timings):
+            print(f"frame {frame}: {1000 * timing:.1f} ms")
+        if timings:
+            print(f"mean render time: {1000 * np.mean(timings):.1f} ms")